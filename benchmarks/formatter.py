@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Rendering throughput of the list formatter.
+
+Renders synthetic file metadata with the default, --long and --fields
+templates of 'gdrive list', and with the --long fields in the ndjson, csv
+and tsv formats, and prints the number of rows per second, e.g.
+
+    python3 benchmarks/formatter.py --rows 1000000
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pydrivecli import formatter
+from pydrivecli.formatter import Formatter, RecordFormatter
+
+
+def make_rows(count):
+    rows = []
+    for i in range(count):
+        rows.append({
+            "id": "%033d" % i,
+            "title": "file-%d.txt" % i,
+            "mimeType": "application/vnd.google-apps.folder" if i % 10 == 0 else "text/plain",
+            "ownerNames": ["owner"],
+            "fileSize": str(i * 1024),
+            "createdDate": "2020-%02d-%02dT%02d:%02d:%02d.000Z" % (i % 12 + 1, i % 28 + 1, i % 24, i % 60, i % 60),
+            "modifiedDate": "2021-%02d-%02dT%02d:%02d:%02d.000Z" % (i % 12 + 1, i % 28 + 1, i % 24, i % 60, i % 60)
+        })
+    return rows
+
+
+def main():
+    parser = ArgumentParser(description = "Measure the rendering throughput of the list formatter.")
+    parser.add_argument(
+        "-n", "--rows",
+        type = int,
+        default = 200000,
+        help = "Set the number of rows to render. (Default: 200000)"
+    )
+    options = parser.parse_args()
+
+    rows = make_rows(options.rows)
+    templates = [
+        ("default", formatter.DEFAULT_TEMPLATE),
+        ("--long", formatter.LONG_TEMPLATE),
+        ("--fields", formatter.fields_template(["title", "id", "createdDate"]))
+    ]
+    with open(os.devnull, "w") as devnull:
+        formatters = [(name, Formatter(template, stream = devnull)) for name, template in templates]
+        for format in formatter.RECORD_FORMATS:
+            columns = formatter.template_fields(formatter.LONG_TEMPLATE)
+            formatters.append((format, RecordFormatter(format, columns, stream = devnull)))
+        for name, rows_formatter in formatters:
+            start = time.perf_counter()
+            for row in rows:
+                rows_formatter.display(row)
+            rows_formatter.flush()
+            elapsed = time.perf_counter() - start
+            print("%-10s %12.0f rows/s" % (name, len(rows) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+import threading
+import time
+
+from .utils import BLOB_CACHE
+
+# total size of the cached contents in bytes before the least recently used
+# contents are evicted
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024 * 1024
+
+__all__ = ["BlobCache"]
+
+
+def link(source, target, copy=True):
+    # hardlink if possible, copy across file systems unless `copy` is False;
+    # the target is replaced in one step, so a half written target is never
+    # seen
+    temporary = Path(target).with_name(".%s.blob" % Path(target).name)
+    if temporary.exists():
+        temporary.unlink()
+    try:
+        os.link(source, temporary)
+    except OSError:
+        if not copy:
+            raise
+        shutil.copyfile(source, temporary)
+    os.replace(temporary, target)
+
+
+class BlobCache(object):
+    """Content-addressed store of downloaded files and exported documents.
+
+    A content is keyed by the id of the file, its revision and the mimetype
+    it was exported to, so a key never refers to different contents. The
+    contents are kept under `path`, named by the digest of their keys, and
+    are hardlinked into the download directory on a hit; the contents of
+    files on another file system are not kept. `index.sqlite3` records the
+    size and mtime of every content, to tell whether it has been modified
+    through a hardlink, and when it was last used, to evict the least
+    recently used contents once there are more than `max_size` bytes.
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS blobs (
+            name TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime INTEGER,
+            accessed REAL
+        );
+    """
+
+    def __init__(self, path=BLOB_CACHE, max_size=DEFAULT_MAX_SIZE):
+        self.path = Path(path)
+        self.path.mkdir(parents = True, exist_ok = True)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.path / "index.sqlite3"), check_same_thread = False)
+        self.connection.executescript(self._schema)
+
+    @staticmethod
+    def key(file, mimetype=None):
+        """Return the key of the content of this file, or None if the file has
+        no revision to tell its contents apart."""
+        revision = file.get("headRevisionId") or file.get("version")
+        if revision is None:
+            return None
+        return hashlib.sha256(("%s/%s/%s" % (file["id"], revision, mimetype or "")).encode()).hexdigest()
+
+    def get(self, key, target):
+        """Link the content with this key to target; return whether it is
+        cached."""
+        blob = self.path / key
+        with self.lock:
+            row = self.connection.execute("SELECT size, mtime FROM blobs WHERE name = ?", (key,)).fetchone()
+        if row is None:
+            return False
+        try:
+            stat = blob.stat()
+            if (stat.st_size, stat.st_mtime_ns) != tuple(row):
+                raise FileNotFoundError()
+            link(blob, target)
+        except FileNotFoundError:
+            self._remove([key])
+            return False
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE blobs SET accessed = ? WHERE name = ?", (time.time(), key))
+        return True
+
+    def put(self, key, source):
+        """Keep the content of source under this key; return whether it is
+        cached."""
+        blob = self.path / key
+        # a content which would evict everything else is not kept, nor one on
+        # another file system, which would take a second copy of every file
+        if os.stat(source).st_size > self.max_size:
+            return False
+        try:
+            link(source, blob, copy = False)
+        except OSError:
+            return False
+        stat = blob.stat()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)", (key, stat.st_size, stat.st_mtime_ns, time.time())
+            )
+        if self.stats()[1] > self.max_size:
+            self.prune(self.max_size)
+        return True
+
+    def stats(self):
+        """Return the number of contents and their total size in bytes."""
+        with self.lock:
+            count, size = self.connection.execute("SELECT COUNT(*), TOTAL(size) FROM blobs").fetchone()
+        return count, int(size)
+
+    def prune(self, max_size=0):
+        """Evict the least recently used contents until at most max_size
+        bytes are left; return the number of contents evicted."""
+        with self.lock:
+            rows = self.connection.execute("SELECT name, size FROM blobs ORDER BY accessed DESC").fetchall()
+        total = 0
+        evicted = []
+        for name, size in rows:
+            total += size
+            if total > max_size:
+                evicted.append(name)
+        self._remove(evicted)
+        return len(evicted)
+
+    def _remove(self, names):
+        for name in names:
+            try:
+                (self.path / name).unlink()
+            except FileNotFoundError:
+                pass
+        with self.lock, self.connection:
+            self.connection.executemany("DELETE FROM blobs WHERE name = ?", [(name,) for name in names])
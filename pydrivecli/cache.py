@@ -0,0 +1,347 @@
+import json
+import sqlite3
+import threading
+import time
+
+from googleapiclient import errors
+from pydrive2.apiattr import ApiAttributeMixin
+from pydrive2.auth import LoadAuth
+from pydrive2.files import ApiRequestError
+
+from .changes import is_removed
+from .utils import METADATA_CACHE
+
+# cached listings are served without asking google drive for this many
+# seconds, afterwards they are revalidated with the etag of the listing
+DEFAULT_TTL = 300
+# total size of the cached metadata in bytes before the least recently used
+# listings are evicted
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+# resolved paths are trusted for this many seconds, unless the changes feed
+# or this application has changed the files on the path in the meantime
+DEFAULT_PATH_TTL = 24 * 60 * 60
+# number of files kept in the metadata snapshot
+DEFAULT_MAX_FILES = 1000000
+# forget every listing instead of looking for the affected ones when this
+# many files have changed
+MAX_INVALIDATIONS = 500
+
+__all__ = ["ListingEtag", "MetadataCache"]
+
+
+class ListingEtag(ApiAttributeMixin):
+    """Fetches the etag of a list request, to revalidate a cached listing.
+
+    Only the etag is requested, so the response has none of the items that
+    GoogleDriveFileList expects; the request goes through `auth.service`
+    directly instead, with the shared drive parameters GoogleDriveFileList
+    adds to every listing, so that the etag is the one of the same query.
+    """
+
+    def __init__(self, auth=None):
+        ApiAttributeMixin.__init__(self)
+        self.auth = auth
+
+    @LoadAuth
+    def fetch(self, param):
+        param = dict(param, fields = "etag", supportsAllDrives = True, includeItemsFromAllDrives = True)
+        param.pop("pageToken", None)
+        try:
+            response = self.auth.service.files().list(**param).execute(http = self.http)
+        except errors.HttpError as error:
+            raise ApiRequestError(error)
+        return response.get("etag")
+
+
+class MetadataCache(object):
+    """On-disk store of file metadata and folder listings.
+
+    The `files` table keeps a summary of every file seen (parents, title,
+    mimeType, md5Checksum, fileSize and etag), while `listings` and
+    `listing_items` keep the exact results of a list request, keyed by its
+    request parameters, so that repeated listings can be answered locally.
+    The `state` table keeps the start page token of the changes feed, which
+    is updated together with the files it has been applied to, and `paths`
+    keeps the ids that paths like 'MyDrive/a/b' have been resolved to.
+    """
+
+    # file properties to request in addition when listings are cached
+    fields = ["parents(id)", "etag"]
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS files (
+            id TEXT PRIMARY KEY,
+            parents TEXT,
+            title TEXT,
+            mimeType TEXT,
+            md5Checksum TEXT,
+            fileSize INTEGER,
+            etag TEXT,
+            updated REAL
+        );
+        CREATE TABLE IF NOT EXISTS listings (
+            key TEXT PRIMARY KEY,
+            etag TEXT,
+            expires REAL,
+            accessed REAL,
+            size INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS listing_items (
+            key TEXT,
+            position INTEGER,
+            id TEXT,
+            metadata TEXT,
+            PRIMARY KEY (key, position)
+        );
+        CREATE TABLE IF NOT EXISTS state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS paths (
+            path TEXT PRIMARY KEY,
+            id TEXT,
+            expires REAL
+        );
+        CREATE INDEX IF NOT EXISTS paths_id ON paths (id);
+    """
+
+    def __init__(self, path=METADATA_CACHE, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, max_files=DEFAULT_MAX_FILES, refresh=False):
+        path.parent.mkdir(parents = True, exist_ok = True)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_files = max_files
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        # listings which are being written by this process, and their sizes
+        self.active = {}
+        self.connection = sqlite3.connect(str(path), check_same_thread = False)
+        self._migrate()
+        self.connection.executescript(self._schema)
+        # running totals, so the tables are only measured again when they
+        # may have grown over their limits
+        (self.listings_size,) = self.connection.execute("SELECT TOTAL(size) FROM listings").fetchone()
+        (self.files_count,) = self.connection.execute("SELECT COUNT(*) FROM files").fetchone()
+
+    @staticmethod
+    def key(param):
+        return json.dumps(dict(param), sort_keys = True)
+
+    def get_listing(self, param, revalidate=None, fresh=False):
+        """Return the cached results of this list request, or None.
+
+        An expired listing, or any listing if `fresh`, is only served if
+        `revalidate`, called with the request parameters, returns the same
+        etag as the cached one.
+        """
+        if self.refresh:
+            return None
+        key = self.key(param)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT etag, expires FROM listings WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        etag, expires = row
+        now = time.time()
+        if expires < now or fresh:
+            if etag is None or revalidate is None or revalidate(param) != etag:
+                return None
+            expires = now + self.ttl
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE listings SET expires = ?, accessed = ? WHERE key = ?", (expires, now, key)
+            )
+            rows = self.connection.execute(
+                "SELECT metadata FROM listing_items WHERE key = ? ORDER BY position", (key,)
+            ).fetchall()
+        return [json.loads(metadata) for (metadata,) in rows]
+
+    def begin_listing(self, param):
+        # drop the old results first, so that a listing which is interrupted
+        # half way is never served
+        key = self.key(param)
+        with self.lock, self.connection:
+            self._delete_listings("key = ?", key)
+            self.connection.execute("DELETE FROM listing_items WHERE key = ?", (key,))
+            self.active[key] = 0
+        return key
+
+    def add_page(self, key, position, page):
+        now = time.time()
+        items = [(key, position + i, file.get("id"), json.dumps(dict(file))) for i, file in enumerate(page)]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO listing_items VALUES (?, ?, ?, ?)", items)
+            self.active[key] = self.active.get(key, 0) + sum(len(item[3]) for item in items)
+            self._update_files(page, now)
+
+    def finish_listing(self, key, etag):
+        now = time.time()
+        with self.lock, self.connection:
+            size = self.active.pop(key, 0)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)", (key, etag, now + self.ttl, now, size)
+            )
+            self.listings_size += size
+            self._evict()
+
+    def invalidate(self, id):
+        with self.lock, self.connection:
+            self._invalidate(id)
+
+    def get_path(self, path):
+        if self.refresh:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id FROM paths WHERE path = ? AND expires >= ?", (path, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_path(self, path, id):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO paths VALUES (?, ?, ?)", (path, id, time.time() + DEFAULT_PATH_TTL)
+            )
+
+    def forget_paths(self, id):
+        with self.lock, self.connection:
+            self._forget_paths(id)
+
+    def get_state(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key, value):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (key, value))
+
+    def apply_changes(self, changes, start_page_token=None, key="startPageToken"):
+        """Apply a page of the changes feed to the metadata snapshot.
+
+        Deleted and trashed files are removed, the others are updated, and
+        the listings of the folders they were or are in are forgotten. The
+        start page token is saved as the state `key` in the same transaction
+        when given.
+        """
+        removed = []
+        updated = []
+        for change in changes:
+            if is_removed(change):
+                removed.append(change["fileId"])
+            else:
+                updated.append(change["file"])
+
+        with self.lock, self.connection:
+            ids = set(removed) | set(file["id"] for file in updated)
+            for file in updated:
+                ids.update(parent["id"] for parent in file.get("parents") or [])
+            for (parents,) in self.connection.execute(
+                "SELECT parents FROM files WHERE id IN (%s)" % ",".join("?" * len(ids)), list(ids)
+            ).fetchall():
+                ids.update(json.loads(parents) if parents else [])
+
+            if len(ids) > MAX_INVALIDATIONS:
+                self.connection.execute("DELETE FROM listings")
+                self.connection.execute("DELETE FROM listing_items")
+                self.listings_size = 0
+            else:
+                for id in ids:
+                    self._invalidate(id)
+            for id in set(removed) | set(file["id"] for file in updated):
+                self._forget_paths(id)
+            self.files_count -= self.connection.executemany("DELETE FROM files WHERE id = ?", [(id,) for id in removed]).rowcount
+            self._update_files(updated, time.time())
+            self._evict()
+            if start_page_token is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO state VALUES (?, ?)", (key, start_page_token)
+                )
+
+    def _forget_paths(self, id):
+        # the paths to this file and every path below it
+        for (path,) in self.connection.execute("SELECT path FROM paths WHERE id = ?", (id,)).fetchall():
+            self.connection.execute(
+                "DELETE FROM paths WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(path) + 1, path + "/")
+            )
+
+    def _invalidate(self, id):
+        # forget every listing whose request mentions this id, e.g. the
+        # listings of a folder after a file is added to it
+        pattern = "%%%s%%" % id
+        self.connection.execute(
+            "DELETE FROM listing_items WHERE key IN (SELECT key FROM listings WHERE key LIKE ?)", (pattern,)
+        )
+        self._delete_listings("key LIKE ?", pattern)
+
+    def _delete_listings(self, condition, *args):
+        (size,) = self.connection.execute("SELECT TOTAL(size) FROM listings WHERE %s" % condition, args).fetchone()
+        self.connection.execute("DELETE FROM listings WHERE %s" % condition, args)
+        self.listings_size -= size
+
+    def _update_files(self, files, now):
+        # keep the known values if this listing did not request some fields;
+        # the count of files may only grow by the files written
+        self.files_count += len(files)
+        self.connection.executemany(
+            """INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                parents = COALESCE(excluded.parents, parents),
+                title = COALESCE(excluded.title, title),
+                mimeType = COALESCE(excluded.mimeType, mimeType),
+                md5Checksum = COALESCE(excluded.md5Checksum, md5Checksum),
+                fileSize = COALESCE(excluded.fileSize, fileSize),
+                etag = COALESCE(excluded.etag, etag),
+                updated = excluded.updated""",
+            [(
+                file.get("id"),
+                json.dumps([parent.get("id") for parent in file["parents"]]) if file.get("parents") is not None else None,
+                file.get("title"),
+                file.get("mimeType"),
+                file.get("md5Checksum"),
+                file.get("fileSize"),
+                file.get("etag"),
+                now
+            ) for file in files if file.get("id")]
+        )
+
+    def _evict(self):
+        # both tables are measured once their running totals are over the
+        # limits, and brought down to nine tenths of the limits, so that they
+        # are not measured again on the next listing
+        if self.files_count > self.max_files:
+            (self.files_count,) = self.connection.execute("SELECT COUNT(*) FROM files").fetchone()
+            if self.files_count > self.max_files:
+                excess = self.files_count - self.max_files * 9 // 10
+                self.connection.execute(
+                    "DELETE FROM files WHERE id IN (SELECT id FROM files ORDER BY updated LIMIT ?)", (excess,)
+                )
+                self.files_count -= excess
+
+        if self.listings_size <= self.max_size:
+            return
+        (self.listings_size,) = self.connection.execute("SELECT TOTAL(size) FROM listings").fetchone()
+        rows = self.connection.execute("SELECT key, size FROM listings ORDER BY accessed").fetchall()
+        for key, size in rows:
+            if self.listings_size <= self.max_size * 9 // 10:
+                break
+            self.connection.execute("DELETE FROM listings WHERE key = ?", (key,))
+            self.connection.execute("DELETE FROM listing_items WHERE key = ?", (key,))
+            self.listings_size -= size
+        # items of listings which were interrupted and never finished
+        for (key,) in self.connection.execute(
+            "SELECT DISTINCT key FROM listing_items WHERE key NOT IN (SELECT key FROM listings)"
+        ).fetchall():
+            if key not in self.active:
+                self.connection.execute("DELETE FROM listing_items WHERE key = ?", (key,))
+
+    def _migrate(self):
+        # the listings cached before their sizes were recorded are dropped
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(listings)")]
+        if columns and "size" not in columns:
+            with self.connection:
+                self.connection.execute("DROP TABLE listings")
+                self.connection.execute("DELETE FROM listing_items")
@@ -0,0 +1,71 @@
+from googleapiclient import errors
+from pydrive2.apiattr import ApiAttributeMixin
+from pydrive2.auth import LoadAuth
+from pydrive2.files import ApiRequestError
+
+__all__ = ["ChangesFeed", "is_removed"]
+
+
+def is_removed(change):
+    # a change either removes the file from the drive, or carries its new
+    # metadata; trashed files are treated as removed
+    file = change.get("file") or {}
+    return bool(change.get("deleted") or file.get("labels", {}).get("trashed"))
+
+
+class ChangesFeed(ApiAttributeMixin):
+    """Google Drive changes feed.
+
+    Equivalent to Changes.getStartPageToken() and Changes.list() in Drive
+    APIs. Like GoogleDrive, all requests go through `auth.service`, so the
+    feed can be pointed at a fake service when there is no network.
+    """
+
+    def __init__(self, auth=None, controller=None):
+        ApiAttributeMixin.__init__(self)
+        self.auth = auth
+        self.controller = controller
+
+    @LoadAuth
+    def get_start_page_token(self):
+        try:
+            response = (
+                self.auth.service.changes()
+                .getStartPageToken(supportsAllDrives = True)
+                .execute(http = self.http)
+            )
+        except errors.HttpError as error:
+            raise ApiRequestError(error)
+        return response["startPageToken"]
+
+    def list_changes(self, page_token, fields):
+        """Yield (changes, new_start_page_token) for every page of changes.
+
+        `fields` are the properties of the changed files to request. The
+        new start page token is only given with the last page.
+        """
+        while page_token is not None:
+            if self.controller is not None:
+                response = self.controller.call(self._list, page_token, fields)
+            else:
+                response = self._list(page_token, fields)
+            yield response.get("items", []), response.get("newStartPageToken")
+            page_token = response.get("nextPageToken")
+
+    @LoadAuth
+    def _list(self, page_token, fields):
+        try:
+            return (
+                self.auth.service.changes()
+                .list(
+                    pageToken = page_token,
+                    maxResults = 1000,
+                    includeDeleted = True,
+                    includeItemsFromAllDrives = True,
+                    supportsAllDrives = True,
+                    fields = "nextPageToken,newStartPageToken,items(fileId,deleted,file(%s))" % ",".join(dict.fromkeys(fields))
+                )
+                .execute(http = self.http)
+            )
+        except errors.HttpError as error:
+            raise ApiRequestError(error)
@@ -9,6 +9,18 @@ from argparse import ArgumentParser
 __all__ = ["parse_command_line", "parse_auth_command_line"]
 
 
+def append_cache_options(parser):
+    parser.add_argument(
+        "--no-cache",
+        action = "store_true",
+        help = "Do not read or write the local caches in ~/.gdrive. (Optional)"
+    )
+    parser.add_argument(
+        "--refresh",
+        action = "store_true",
+        help = "Ignore the cached metadata and fetch it again from google drive. (Optional)"
+    )
+
 def append_list_options(subparsers):
     list_opts = subparsers.add_parser(
         "list",
@@ -38,6 +50,23 @@ def append_list_options(subparsers):
         "-F", "--fields",
         help = "Show these fields instead. The fields should be comma separated, for example: 'title,id,createdDate'. This option has the highest priority in this group. (Optional)"
     )
+    display_opts_group.add_argument(
+        "-j", "--jobs",
+        type = int,
+        default = 8,
+        help = "Set the number of folders to be listed concurrently when listing recursively. (Default: 8)"
+    )
+    display_opts_group.add_argument(
+        "--fields-mask",
+        help = "Request these metadata fields from google drive instead of the fields needed by the display options. The fields should be comma separated, for example: 'title,id,createdDate'. (Optional)"
+    )
+    display_opts_group.add_argument(
+        "--format",
+        default = "text",
+        choices = ["text", "ndjson", "csv", "tsv"],
+        help = "Set the output format. Except text, every format writes one record per file with the fields shown by the other options in this group, and the folder of the file when listing recursively. (Default: text)"
+    )
+    append_cache_options(display_opts_group)
     # Files filters options
     filter_opts_group = list_opts.add_argument_group(
         title = "File Filter Options"
@@ -50,7 +79,7 @@ def append_list_options(subparsers):
     filter_opts_group.add_argument(
         "-i", "--id",
         action = "append",
-        help = "Show the detail of these folders. (Optional)"
+        help = "Show the detail of these folders, given by their ids or paths like 'MyDrive/a/b'. (Optional)"
     )
     filter_opts_group.add_argument(
         "-f", "--filename",
@@ -61,6 +90,11 @@ def append_list_options(subparsers):
         "-q", "--query",
         help = "Use this query instead the default query and options in this group, when searching and listing files. This option has the highest priority in this group. (Optional)"
     )
+    filter_opts_group.add_argument(
+        "--changed-since-last-run",
+        action = "store_true",
+        help = "Only list the files which have changed since the last time this option was used with 'gdrive list'. This option has the highest priority in this group. (Optional)"
+    )
 
 def append_download_options(subparsers):
     download_opts = subparsers.add_parser(
@@ -73,6 +107,11 @@ def append_download_options(subparsers):
         action = "store_true",
         help = "Force to download the files to your local storage even if files with same names already exists. (Optional)"
     )
+    download_opts.add_argument(
+        "-u", "--update",
+        action = "store_true",
+        help = "Download the files which already exist only if they differ from the files in your google drive, comparing their sizes and md5 checksums. (Optional)"
+    )
     download_opts.add_argument(
         "-r", "--recursive",
         action = "store_true",
@@ -82,6 +121,29 @@ def append_download_options(subparsers):
         "-P", "--path",
         help = "Overwrite the default output directory. (Optional)"
     )
+    download_opts.add_argument(
+        "--fields-mask",
+        help = "Request these metadata fields from google drive in addition to the fields needed to download the files. The fields should be comma separated, for example: 'title,id,createdDate'. (Optional)"
+    )
+    download_opts.add_argument(
+        "-j", "--jobs",
+        type = int,
+        default = 4,
+        help = "Set the number of files to be downloaded concurrently. (Default: 4)"
+    )
+    download_opts.add_argument(
+        "--order",
+        choices = ["largest", "smallest", "listed"],
+        default = "largest",
+        help = "Download the largest files waiting in the queue first, the smallest files first, or the files in the order they are listed. (Default: largest)"
+    )
+    download_opts.add_argument(
+        "--segments",
+        type = int,
+        default = 1,
+        help = "Download each large file in up to this many byte ranges concurrently; files are only split into segments of at least 32 MB. (Default: 1)"
+    )
+    append_cache_options(download_opts)
     # Files filters options
     filter_opts_group = download_opts.add_argument_group(
         title = "File Filter Options"
@@ -100,6 +162,11 @@ def append_download_options(subparsers):
         "-q", "--query",
         help = "Download all files that pass this query. This option has the highest priority in this group. (Optional)"
     )
+    filter_opts_group.add_argument(
+        "--changed-since-last-run",
+        action = "store_true",
+        help = "Only download the files which have changed since the last download with this option which finished without errors. This option has the highest priority in this group. (Optional)"
+    )
     # Files export options
     file_export_opts = download_opts.add_argument_group(
         title = "File Export Options"
@@ -119,6 +186,63 @@ def append_download_options(subparsers):
         help = "Set the export format for google workspace documents. You should provide the export format in a comma seperated key value pair format: key1=value1,key2=value2 (Optional)"
     )
 
+def append_jobs_options(subparsers):
+    subparsers.add_parser(
+        "jobs",
+        prog = "gdrive jobs",
+        help = "List the downloads and uploads which were interrupted or had failures, as recorded in ~/.gdrive/jobs."
+    )
+
+def append_resume_options(subparsers):
+    resume_opts = subparsers.add_parser(
+        "resume",
+        prog = "gdrive resume",
+        help = "Transfer only the files left by an interrupted download or upload."
+    )
+    resume_opts.add_argument(
+        "id",
+        help = "Set the id of the job to be resumed, as listed by 'gdrive jobs'."
+    )
+
+def append_sync_options(subparsers):
+    sync_opts = subparsers.add_parser(
+        "sync",
+        prog = "gdrive sync",
+        help = "Upload the files of a local folder which are new or have changed since they were last synced to a folder in your google drive."
+    )
+    sync_opts.add_argument(
+        "local",
+        help = "Set the local folder to be synced."
+    )
+    sync_opts.add_argument(
+        "remote",
+        help = "Set the id or path (e.g. 'MyDrive/backups/build') of the folder to sync to."
+    )
+    sync_opts.add_argument(
+        "--delete",
+        action = "store_true",
+        help = "Trash the files and folders in your google drive which are not in the local folder. (Optional)"
+    )
+    sync_opts.add_argument(
+        "-j", "--jobs",
+        type = int,
+        default = 4,
+        help = "Set the number of files to be uploaded concurrently. (Default: 4)"
+    )
+    sync_opts.add_argument(
+        "--order",
+        choices = ["largest", "smallest", "listed"],
+        default = "largest",
+        help = "Upload the largest files waiting in the queue first, the smallest files first, or the files in the order they are found. (Default: largest)"
+    )
+    sync_opts.add_argument(
+        "--chunk-size",
+        type = float,
+        default = 8,
+        help = "Send files in chunks of about this many MB; an interrupted upload is continued from its last chunk the next time it is run. (Default: 8)"
+    )
+    append_cache_options(sync_opts)
+
 def append_upload_options(subparsers):
     upload_opts = subparsers.add_parser(
         "upload",
@@ -144,8 +268,27 @@ def append_upload_options(subparsers):
     upload_opts.add_argument(
         "-R", "--root",
         default = "root",
-        help = "Upload file to the folder with this id. (Optional)"
+        help = "Upload file to the folder with this id or path, e.g. 'MyDrive/a/b'. (Optional)"
     )
+    upload_opts.add_argument(
+        "-j", "--jobs",
+        type = int,
+        default = 4,
+        help = "Set the number of files to be uploaded concurrently, across every folder. (Default: 4)"
+    )
+    upload_opts.add_argument(
+        "--order",
+        choices = ["largest", "smallest", "listed"],
+        default = "largest",
+        help = "Upload the largest files waiting in the queue first, the smallest files first, or the files in the order they are found. (Default: largest)"
+    )
+    upload_opts.add_argument(
+        "--chunk-size",
+        type = float,
+        default = 8,
+        help = "Send files in chunks of about this many MB; an interrupted upload is continued from its last chunk the next time it is run. (Default: 8)"
+    )
+    append_cache_options(upload_opts)
 
 def append_create_options(subparsers):
     create_opts = subparsers.add_parser(
@@ -161,7 +304,7 @@ def append_create_options(subparsers):
     create_opts.add_argument(
         "-R", "--root",
         default = "root",
-        help = "Create a file / folder to the folder with this id. (Optional)"
+        help = "Create a file / folder to the folder with this id or path, e.g. 'MyDrive/a/b'. (Optional)"
     )
     create_opts.add_argument(
         "-d", "--allow-duplicate",
@@ -172,6 +315,7 @@ def append_create_options(subparsers):
         "-c", "--contents",
         help = "Set the content string for this file. If the content string is provided, it is assumed that you are creating a file not a folder. (Optional)"
     )
+    append_cache_options(create_opts)
 
 def append_delete_options(subparsers):
     delete_ops = subparsers.add_parser(
@@ -182,8 +326,9 @@ def append_delete_options(subparsers):
     delete_ops.add_argument(
         "ids",
         nargs = "+",
-        help = "Set the ids of the file or folder to be deleted."
+        help = "Set the ids or paths (e.g. 'MyDrive/a/b.txt') of the file or folder to be deleted."
     )
+    append_cache_options(delete_ops)
 
 def append_trash_options(subparsers):
     trash_opts = subparsers.add_parser(
@@ -194,8 +339,9 @@ def append_trash_options(subparsers):
     trash_opts.add_argument(
         "ids",
         nargs = "+",
-        help = "Set the ids of the file or folder to be trashed."
+        help = "Set the ids or paths (e.g. 'MyDrive/a/b.txt') of the file or folder to be trashed."
     )
+    append_cache_options(trash_opts)
 
 def append_untrash_options(subparsers):
     untrash_opts = subparsers.add_parser(
@@ -206,8 +352,9 @@ def append_untrash_options(subparsers):
     untrash_opts.add_argument(
         "ids",
         nargs = "+",
-        help = "Set the ids of the file or folder to be untrashed."
+        help = "Set the ids or paths (e.g. 'MyDrive/a/b.txt') of the file or folder to be untrashed."
     )
+    append_cache_options(untrash_opts)
 
 def append_move_options(subparsers):
     move_opts = subparsers.add_parser(
@@ -218,12 +365,13 @@ def append_move_options(subparsers):
     move_opts.add_argument(
         "sources",
         nargs = "+",
-        help = "Set the ids of the files or folders to be moved."
+        help = "Set the ids or paths (e.g. 'MyDrive/a/b.txt') of the files or folders to be moved."
     )
     move_opts.add_argument(
         "destination",
-        help = "Set the destination folder id."
+        help = "Set the id or path (e.g. 'MyDrive/archive/') of the destination folder."
     )
+    append_cache_options(move_opts)
 
 def append_rename_options(subparsers):
     rename_opts = subparsers.add_parser(
@@ -233,7 +381,7 @@ def append_rename_options(subparsers):
     )
     rename_opts.add_argument(
         "id",
-        help = "Set the id of the file or folder to be renamed."
+        help = "Set the id or path (e.g. 'MyDrive/a/b.txt') of the file or folder to be renamed."
     )
     rename_opts.add_argument(
         "name",
@@ -244,6 +392,7 @@ def append_rename_options(subparsers):
         action = "store_true",
         help = "Allow duplicated name. (Optional)"
     )
+    append_cache_options(rename_opts)
 
 def append_share_options(subparsers):
     share_opts = subparsers.add_parser(
@@ -254,7 +403,7 @@ def append_share_options(subparsers):
     share_opts.add_argument(
         "ids",
         nargs = "+",
-        help = "Set the ids of the files or folders to be shared."
+        help = "Set the ids or paths (e.g. 'MyDrive/a/b.txt') of the files or folders to be shared."
     )
     share_opts.add_argument(
         "-t", "--type",
@@ -277,6 +426,7 @@ def append_share_options(subparsers):
         action = "store_true",
         help = "Set the shared file to be  readable. (Default)"
     )
+    append_cache_options(share_opts)
 
 def append_unshare_options(subparsers):
     unshare_opts = subparsers.add_parser(
@@ -287,7 +437,7 @@ def append_unshare_options(subparsers):
     unshare_opts.add_argument(
         "ids",
         nargs = "+",
-        help = "Set the ids of the files or folders to be unshared."
+        help = "Set the ids or paths (e.g. 'MyDrive/a/b.txt') of the files or folders to be unshared."
     )
     unshare_opts.add_argument(
         "-t", "--type",
@@ -299,6 +449,61 @@ def append_unshare_options(subparsers):
         "-u", "--user",
         help = "Set the email address of the user who you want to unshare the file or folder with. (Optional, and required only --type=user)"
     )
+    append_cache_options(unshare_opts)
+
+def append_changes_options(subparsers):
+    changes_opts = subparsers.add_parser(
+        "changes",
+        prog = "gdrive changes",
+        help = "Show the files which have changed since the last time this command was run, and update the local metadata of these files."
+    )
+    changes_opts.add_argument(
+        "--reset",
+        action = "store_true",
+        help = "Forget the changes so far and track the changes from now on. (Optional)"
+    )
+
+def append_cat_options(subparsers):
+    cat_opts = subparsers.add_parser(
+        "cat",
+        prog = "gdrive cat",
+        help = "Write the contents of a file to the standard output without saving it to your local storage."
+    )
+    cat_opts.add_argument(
+        "id",
+        help = "Set the id or path (e.g. 'MyDrive/a/b.txt') of the file to be read."
+    )
+    cat_opts.add_argument(
+        "--range",
+        help = "Only write the bytes in this range, given as START-END (inclusive) or START-, e.g. 0-1023. (Optional)"
+    )
+    cat_opts.add_argument(
+        "-p", "--pdf",
+        action = "store_true",
+        help = "Export google workspace documents to pdf. (Optional)"
+    )
+    cat_opts.add_argument(
+        "-e", "--export-format",
+        help = "Set the export format for google workspace documents. You should provide the export format in a comma seperated key value pair format: key1=value1,key2=value2 (Optional)"
+    )
+    append_cache_options(cat_opts)
+
+def append_cache_command_options(subparsers):
+    cache_opts = subparsers.add_parser(
+        "cache",
+        prog = "gdrive cache",
+        help = "Show or prune the downloaded files and exported documents kept in ~/.gdrive/cache."
+    )
+    cache_opts.add_argument(
+        "action",
+        choices = ["stats", "prune"],
+        help = "Show the number and the total size of the cached files, or evict the least recently used of them."
+    )
+    cache_opts.add_argument(
+        "--max-size",
+        type = float,
+        help = "Keep the most recently used files up to this size in MB when pruning. (Default: 0, evict everything)"
+    )
 
 def parse_command_line():
     parser = ArgumentParser(
@@ -308,12 +513,18 @@ def parse_command_line():
         dest = "choice",
         title = "commands"
     )
+    append_cache_command_options(subparsers)
+    append_cat_options(subparsers)
+    append_changes_options(subparsers)
     append_create_options(subparsers)
     append_delete_options(subparsers)
     append_download_options(subparsers)
+    append_jobs_options(subparsers)
     append_list_options(subparsers)
     append_move_options(subparsers)
     append_rename_options(subparsers)
+    append_resume_options(subparsers)
+    append_sync_options(subparsers)
     append_trash_options(subparsers)
     append_untrash_options(subparsers)
     append_upload_options(subparsers)
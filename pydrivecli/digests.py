@@ -0,0 +1,84 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from .utils import DIGEST_CACHE
+
+# bytes read at a time when hashing a file
+BLOCK_SIZE = 1024 * 1024
+# number of digests kept before the ones checked least recently are dropped
+DEFAULT_MAX_DIGESTS = 1000000
+
+__all__ = ["DigestCache", "file_md5"]
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class DigestCache(object):
+    """On-disk store of the md5 digests of local files.
+
+    A digest is keyed by the device and inode of the file and is only reused
+    while the size and the modification time of the file are unchanged, so
+    a file is hashed again only after it has been written to.
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS digests (
+            device INTEGER,
+            inode INTEGER,
+            size INTEGER,
+            mtime INTEGER,
+            md5 TEXT,
+            checked REAL,
+            PRIMARY KEY (device, inode)
+        );
+    """
+
+    def __init__(self, path=DIGEST_CACHE, max_digests=DEFAULT_MAX_DIGESTS):
+        path.parent.mkdir(parents = True, exist_ok = True)
+        self.max_digests = max_digests
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread = False)
+        self.connection.executescript(self._schema)
+        self.hashed = 0
+
+    def md5(self, path):
+        """Return the md5 digest of the file at path, hashing it if needed."""
+        stat = os.stat(path)
+        key = (stat.st_dev, stat.st_ino)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size, mtime, md5 FROM digests WHERE device = ? AND inode = ?", key
+            ).fetchone()
+        if row is not None and row[:2] == (stat.st_size, stat.st_mtime_ns):
+            return row[2]
+
+        md5 = file_md5(path)
+        # the file may have been written to while it was hashed
+        if os.stat(path).st_mtime_ns != stat.st_mtime_ns:
+            return md5
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)",
+                key + (stat.st_size, stat.st_mtime_ns, md5, time.time())
+            )
+            self.hashed += 1
+            if self.hashed % 1000 == 0:
+                self._evict()
+        return md5
+
+    def _evict(self):
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM digests").fetchone()
+        if count > self.max_digests:
+            self.connection.execute(
+                "DELETE FROM digests WHERE rowid IN (SELECT rowid FROM digests ORDER BY checked LIMIT ?)",
+                (count - self.max_digests,)
+            )
@@ -0,0 +1,273 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+import json
+import math
+import os
+from pathlib import Path
+import re
+import threading
+
+from googleapiclient import errors
+from httplib2 import HttpLib2Error
+from pydrive2.apiattr import ApiAttributeMixin
+from pydrive2.auth import LoadAuth
+from pydrive2.files import ApiRequestError
+
+from .digests import file_md5
+
+MEDIA_URL = "https://www.googleapis.com/drive/v2/files/%s?alt=media&supportsAllDrives=true"
+EXPORT_URL = "https://www.googleapis.com/drive/v2/files/%s/export?mimeType=%s"
+# bytes requested by one range request; the progress is saved after each
+CHUNK_SIZE = 8 * 1024 * 1024
+PART_SUFFIX = ".part"
+# a file is only split into segments of at least this many bytes
+MIN_SEGMENT_SIZE = 32 * 1024 * 1024
+
+__all__ = ["ChecksumError", "ContentStream", "ResumableDownload", "SegmentedDownload", "EXPORT_URL", "MEDIA_URL", "MIN_SEGMENT_SIZE"]
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def api_error(response, content, uri):
+    # ApiRequestError expects the json error body of the drive api, which
+    # the media endpoints do not always send
+    try:
+        json.loads(content.decode("utf-8"))
+    except ValueError:
+        content = json.dumps({"error": {"code": response.status, "message": response.reason}}).encode("utf-8")
+    return ApiRequestError(errors.HttpError(response, content, uri = uri))
+
+
+class MediaRequest(ApiAttributeMixin):
+    def __init__(self, auth, url, chunk_size=CHUNK_SIZE, controller=None):
+        ApiAttributeMixin.__init__(self)
+        self.auth = auth
+        self.url = url
+        self.chunk_size = chunk_size
+        # every range request goes through the rate controller, if any
+        self.controller = controller
+
+    def _get(self, http, start, end):
+        if self.controller is not None:
+            return self.controller.call(self._request_range, http, start, end)
+        return self._request_range(http, start, end)
+
+    def _request_range(self, http, start, end):
+        try:
+            response, content = http.request(
+                self.url,
+                method = "GET",
+                headers = {"Range": "bytes=%d-%d" % (start, end)}
+            )
+        except (HTTPException, HttpLib2Error) as e:
+            raise ConnectionError("connection lost at byte %d; %s" % (start, str(e)))
+        if response.status >= 300 and response.status != 416:
+            raise api_error(response, content, self.url)
+        return response, content
+
+
+class ContentStream(MediaRequest):
+    """Copies the content at `url` into a stream, one chunk at a time.
+
+    Only one chunk is held in memory at once, whatever the size of the
+    content, and `start` and `end` select an inclusive byte range of it.
+    """
+
+    @LoadAuth
+    def copy(self, stream, start=0, end=None):
+        offset = start
+        while end is None or offset <= end:
+            last = offset + self.chunk_size - 1
+            if end is not None:
+                last = min(last, end)
+            response, content = self._get(self.http, offset, last)
+            if response.status == 416:
+                break
+            if response.status == 200:
+                # the whole content was sent regardless of the range, e.g.
+                # the exports of google workspace documents
+                stream.write(content[offset:None if end is None else end + 1])
+                stream.flush()
+                break
+            stream.write(content)
+            stream.flush()
+            if len(content) < last - offset + 1:
+                break
+            offset += len(content)
+            match = _CONTENT_RANGE.match(response.get("content-range", ""))
+            if match and match.group(3) != "*" and offset >= int(match.group(3)):
+                break
+
+
+class ResumableDownload(MediaRequest):
+    """Downloads the content at `url` to `path` with range requests.
+
+    The content is written to '<path>.part', and '<path>.part.json' records
+    the revision being downloaded and how many bytes of the .part file have
+    been written safely. A later download of the same revision continues
+    from there, a download of any other revision starts over. The .part file
+    is renamed to `path` once it is complete.
+    """
+
+    def __init__(self, auth, url, path, revision=None, size=None, chunk_size=CHUNK_SIZE, controller=None):
+        super().__init__(auth, url, chunk_size, controller)
+        self.path = Path(path)
+        self.part = Path("%s%s" % (path, PART_SUFFIX))
+        self.state = Path("%s%s.json" % (path, PART_SUFFIX))
+        self.revision = revision
+        self.size = size
+
+    def offset(self):
+        """Return the number of bytes which can be kept from a previous run."""
+        state = self._load()
+        if state is None:
+            return 0
+        return min(state.get("offset", 0), self.part.stat().st_size)
+
+    @LoadAuth
+    def run(self, callback=None):
+        offset = self.offset()
+        with open(self.part, "r+b" if offset else "wb") as fd:
+            fd.truncate(offset)
+            fd.seek(offset)
+            while self.size is None or offset < self.size:
+                content = self._request(fd, offset)
+                if content is None:
+                    break
+                fd.write(content)
+                fd.flush()
+                os.fsync(fd.fileno())
+                offset = fd.tell()
+                self._save(offset)
+                if callback:
+                    callback(offset, self.size)
+                if not content or (self.size is None and len(content) < self.chunk_size):
+                    break
+        os.replace(self.part, self.path)
+        if self.state.exists():
+            self.state.unlink()
+        if callback and not offset:
+            callback(0, 0)
+
+    def _request(self, fd, offset):
+        # return the next bytes after offset, or None past the end
+        end = offset + self.chunk_size - 1
+        if self.size is not None:
+            end = min(end, self.size - 1)
+        response, content = self._get(self.http, offset, end)
+        if response.status == 416:
+            return None
+        if response.status == 200:
+            # the whole content was sent regardless of the range
+            fd.seek(0)
+            fd.truncate(0)
+            self.size = len(content)
+            return content
+        match = _CONTENT_RANGE.match(response.get("content-range", ""))
+        if match and match.group(3) != "*":
+            self.size = int(match.group(3))
+        if match and int(match.group(1)) != offset:
+            raise ConnectionError("expected the bytes from %d but got %s" % (offset, match.group(0)))
+        return content
+
+    def _load(self):
+        # the progress of a previous run of the same revision, if any
+        if self.revision is None or not self.part.exists():
+            return None
+        try:
+            with open(self.state, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("url") != self.url or state.get("revision") != self.revision:
+            # the file has changed since, the bytes are of no use
+            return None
+        return state
+
+    def _save(self, offset=None, **state):
+        if self.revision is None:
+            return
+        state.update(url = self.url, revision = self.revision)
+        if offset is not None:
+            state["offset"] = offset
+        temporary = Path("%s.tmp" % self.state)
+        with open(temporary, "w") as f:
+            json.dump(state, f)
+        os.replace(temporary, self.state)
+
+
+class SegmentedDownload(ResumableDownload):
+    """Downloads the content in several byte ranges at once.
+
+    The .part file is allocated to the full size of the file up front, and
+    every range is written in place by its own connection. The .part.json
+    file records how far each range has got, so an interrupted download
+    resumes every range where it stopped. The complete file is checked
+    against `md5` before it is renamed to `path`.
+    """
+
+    def __init__(self, auth, url, path, revision, size, md5=None, segments=4, chunk_size=CHUNK_SIZE, controller=None):
+        super().__init__(auth, url, path, revision, size, chunk_size, controller)
+        self.md5 = md5
+        self.segments = segments
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.ranges = []
+
+    def offset(self):
+        return sum(done - start for start, done, end in self.ranges or self._ranges())
+
+    @LoadAuth
+    def run(self, callback=None):
+        self.ranges = self._ranges()
+        resumed = self.offset() > 0
+        with open(self.part, "r+b" if resumed else "wb") as fd:
+            if not resumed:
+                fd.truncate(self.size)
+            if callback:
+                callback(self.offset(), self.size)
+            with ThreadPoolExecutor(max_workers = max(1, len(self.ranges))) as executor:
+                futures = [executor.submit(self._fetch, fd, index, callback) for index in range(len(self.ranges))]
+                try:
+                    for future in futures:
+                        future.result()
+                finally:
+                    self.stopped.set()
+        if self.md5 is not None and file_md5(self.part) != self.md5:
+            self.part.unlink()
+            if self.state.exists():
+                self.state.unlink()
+            raise ChecksumError("the downloaded content does not match its md5 checksum %s" % self.md5)
+        os.replace(self.part, self.path)
+        if self.state.exists():
+            self.state.unlink()
+
+    def _ranges(self):
+        # [start, done, end) of every segment
+        state = self._load()
+        if state is not None and state.get("size") == self.size and state.get("ranges"):
+            return state["ranges"]
+        step = math.ceil(self.size / self.segments) or 1
+        return [[start, start, min(start + step, self.size)] for start in range(0, self.size, step)]
+
+    def _fetch(self, fd, index, callback):
+        # every segment needs its own connection
+        http = self.auth.Get_Http_Object()
+        segment = self.ranges[index]
+        while segment[1] < segment[2] and not self.stopped.is_set():
+            end = min(segment[1] + self.chunk_size, segment[2]) - 1
+            response, content = self._get(http, segment[1], end)
+            if response.status != 206 or not content:
+                raise ConnectionError("expected the bytes %d-%d but the server did not send them" % (segment[1], end))
+            content = content[:segment[2] - segment[1]]
+            os.pwrite(fd.fileno(), content, segment[1])
+            with self.lock:
+                os.fsync(fd.fileno())
+                segment[1] += len(content)
+                self._save(size = self.size, ranges = self.ranges)
+                if callback:
+                    callback(self.offset(), self.size)
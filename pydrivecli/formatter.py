@@ -1,18 +1,154 @@
+import csv
+import json
+import re
+import string
+import sys
+import time
+
 from . import texts
+from .traversal import FOLDER_MIMETYPE
+
+# rows are written out once this many characters are buffered, or once this
+# many seconds have passed since they were last written out
+BUFFER_SIZE = 64 * 1024
+FLUSH_INTERVAL = 0.2
+
+DEFAULT_TEMPLATE = "{id:40}\t{title:20}"
+LONG_TEMPLATE = "{id:40}\t{ownerNames[0]:10}\t{fileSize:>10}\t{modifiedDate}\t{title:20}"
+
+FOLDER_TITLE = texts.FolderText("%s")
+FILE_TITLE = texts.FileText("%s")
+
+RECORD_FORMATS = ("ndjson", "csv", "tsv")
+
+
+def fields_template(fields):
+    return "\n".join("%-10s: {%s}" % (i.upper(), i) for i in fields) + "\n"
+
+
+def template_fields(template):
+    # the metadata properties referenced by the template, e.g. both
+    # '{ownerNames[0]}' and '{ownerNames}' refer to 'ownerNames'
+    fields = []
+    for _, field_name, _, _ in string.Formatter().parse(template):
+        if field_name:
+            fields.append(re.split(r"[.\[]", field_name, 1)[0])
+    return list(dict.fromkeys(fields))
 
-class Formatter(object):
-    def __init__(self, template="{id:40}\t{title:20}"):
+
+class BufferedWriter(object):
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.buffer = []
+        self.buffer_size = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffer_size += len(text)
+        if self.buffer_size >= BUFFER_SIZE or time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            stream = self.stream or sys.stdout
+            stream.write("".join(self.buffer))
+            stream.flush()
+        self.buffer = []
+        self.buffer_size = 0
+        self.last_flush = time.monotonic()
+
+
+class Formatter(BufferedWriter):
+    def __init__(self, template=DEFAULT_TEMPLATE, stream=None):
+        super().__init__(stream)
         self.template = template
 
+    @property
+    def template(self):
+        return self._template
+
+    @template.setter
+    def template(self, template):
+        # compile the template once: find the fields it uses and how to get
+        # each of them from the metadata
+        self._template = template
+        self._format = template.format_map
+        self._getters = [(field, self._getter(field)) for field in self.fields()]
+
+    def fields(self):
+        return template_fields(self.template)
+
+    def render(self, metadata):
+        return self._format({field: getter(metadata) for field, getter in self._getters})
+
+    def display(self, metadata):
+        self.write(self.render(metadata) + "\n")
+
+    def folder(self, path):
+        self.write(texts.FolderText(path).add_prefix("\n").add_suffix(":\n"))
+
+    def message(self, text):
+        self.write(text + "\n")
+
+    @staticmethod
+    def _getter(field):
+        if field in ("createdDate", "modifiedDate"):
+            return lambda metadata: texts.format_datetime(metadata.get(field, ""))
+        elif field == "fileSize":
+            return lambda metadata: texts.format_file_size(metadata.get("fileSize", None))
+        elif field == "title":
+            def _title(metadata):
+                if metadata.get("mimeType") == FOLDER_MIMETYPE:
+                    return FOLDER_TITLE % metadata.get("title", "")
+                return FILE_TITLE % metadata.get("title", "")
+            return _title
+        else:
+            return lambda metadata: metadata[field]
+
+
+class RecordFormatter(BufferedWriter):
+    """Writes one machine-readable record per file, as ndjson, csv or tsv.
+
+    The records hold the raw values of the `columns` of the metadata, and the
+    path of the folder of the file if `path` is one of the columns.
+    """
+
+    def __init__(self, format="ndjson", columns=None, stream=None):
+        super().__init__(stream)
+        if format not in RECORD_FORMATS:
+            raise ValueError("Unknown output format '%s'. Availiable formats are: '%s'" % (format, ", ".join(RECORD_FORMATS)))
+        self.format = format
+        self.columns = list(columns or template_fields(DEFAULT_TEMPLATE))
+        self.path = None
+        if format == "ndjson":
+            self._encode = json.JSONEncoder(ensure_ascii = False).encode
+        else:
+            # csv writes each row straight into the buffer
+            self._writer = csv.writer(self, delimiter = "," if format == "csv" else "\t", lineterminator = "\n")
+            self._writer.writerow(self.columns)
+
+    def fields(self):
+        return [column for column in self.columns if column != "path"]
+
     def display(self, metadata):
-        data = metadata.copy()
-        data.update({
-            "createdDate": texts.DatetimeText(data.get("createdDate", "")),
-            "modifiedDate": texts.DatetimeText(data.get("modifiedDate", "")),
-            "fileSize": texts.FileSizeText(data.get("fileSize", None))
-        })
-        if data.get("mimeType") == "application/vnd.google-apps.folder":
-            data["title"] = texts.FolderText(data.get("title", ""))
+        values = [self.path if column == "path" else metadata.get(column) for column in self.columns]
+        if self.format == "ndjson":
+            self.write(self._encode(dict(zip(self.columns, values))) + "\n")
         else:
-            data["title"] = texts.FileText(data.get("title", ""))
-        print(self.template.format(**data), end = "\n")
\ No newline at end of file
+            self._writer.writerow([self._cell(value) for value in values])
+
+    def folder(self, path):
+        self.path = path
+
+    def message(self, text):
+        # messages are not records, keep them out of the data stream
+        print(text, file = sys.stderr)
+
+    @staticmethod
+    def _cell(value):
+        if value is None:
+            return ""
+        if isinstance(value, str):
+            return value
+        return json.dumps(value, ensure_ascii = False)
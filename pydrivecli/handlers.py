@@ -1,18 +1,35 @@
 from abc import ABC, abstractmethod
+from argparse import Namespace
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from pathlib import Path
-from queue import Queue
+import os
 import re
 import sys
 import threading
 
-from tqdm import tqdm
-from pydrive2.files import ApiRequestError
+from pydrive2.files import ApiRequestError, FileNotDownloadableError, GoogleDriveFile
+from urllib.parse import quote
 
 from . import requests
 from . import utils
 from . import texts
-from .formatter import Formatter
+from .blobs import BlobCache, link
+from .cache import ListingEtag, MetadataCache
+from .digests import DigestCache, file_md5
+from .downloads import ChecksumError, ContentStream, EXPORT_URL, MEDIA_URL, PART_SUFFIX, MIN_SEGMENT_SIZE, ResumableDownload, SegmentedDownload
+from .changes import ChangesFeed, is_removed
+from . import formatter
+from .formatter import Formatter, RecordFormatter
+from .journal import Journal, JournalError
+from .progress import ProgressDisplay
+from .resolver import PathResolver, ResolveError
+from . import throttle
+from .transfers import TransferQueue
+from . import uploads
+from .uploads import FolderInsert, IdGenerator, ResumableUpload
+from .traversal import FolderWalker, FOLDER_MIMETYPE
 
 def create_handler(type):
     if type == "list":
@@ -21,6 +38,8 @@ def create_handler(type):
         return DownloadHandler()
     elif type == "upload":
         return UploadHandler()
+    elif type == "sync":
+        return SyncHandler()
     elif type == "create":
         return CreateHandler()
     elif type == "trash":
@@ -37,6 +56,16 @@ def create_handler(type):
         return ShareHandler()
     elif type == "unshare":
         return UnShareHandler()
+    elif type == "changes":
+        return ChangesHandler()
+    elif type == "cat":
+        return CatHandler()
+    elif type == "cache":
+        return CacheHandler()
+    elif type == "resume":
+        return ResumeHandler()
+    elif type == "jobs":
+        return JobsHandler()
     else:
         raise NotImplementedError(f"{type} handler has not been implemented.")
 
@@ -44,10 +73,156 @@ class Handler(ABC):
     def __init__(self, type):
         self.drive = None
         self.type = type
+        self.cache = None
+        self.resolver = None
+        self.controller = throttle.controller
+        self.progress = None
+        self.formatter = None
+        self.journal = None
+        self.start_page_token = None
+        # whether cached listings are revalidated before they are served and
+        # cached paths checked, for the commands which transfer or change
+        # files based on them
+        self.fresh = False
 
     def attach(self, drive):
         self.drive = drive
 
+    def _open_cache(self, options):
+        if not options.no_cache:
+            self.cache = MetadataCache(refresh = options.refresh)
+
+    def _resolve(self, values):
+        # accept paths like 'MyDrive/a/b' wherever ids are expected; the
+        # commands which change files check the ids of cached paths first
+        if self.resolver is None:
+            self.resolver = PathResolver(self._list_files, self.cache, self._fetch_file if self.fresh else None)
+        try:
+            return self.resolver.resolve([value.strip() for value in values])
+        except (ResolveError, ApiRequestError) as e:
+            print("error: %s" % str(e))
+            sys.exit(1)
+
+    def _fetch_file(self, id):
+        file = self.drive.CreateFile(metadata = {"id": id})
+        try:
+            self.controller.call(file.FetchMetadata, fields = "id,title,parents(id,isRoot),labels(trashed)")
+        except ApiRequestError as e:
+            if e.error.get("code") != 404:
+                raise
+            return None
+        return file
+
+    def _forget_paths(self, id):
+        if self.cache is not None:
+            self.cache.forget_paths(id)
+
+    def _message(self, text):
+        # keep messages clear of the progress display while it is shown, and
+        # out of the records written by the formatter
+        if self.progress is not None:
+            self.progress.message(text)
+        elif self.formatter is not None:
+            self.formatter.message(text)
+        else:
+            print(text)
+
+    def _cache_fields(self):
+        return MetadataCache.fields if self.cache is not None else []
+
+    def _list_files(self, param):
+        # yield the files page by page as they arrive instead of collecting
+        # every page into a single list first
+        if self.cache is None:
+            for page in self._pages(self.drive.ListFile(param = param)):
+                for file in page:
+                    yield file
+            return
+
+        cached_files = self.cache.get_listing(param, revalidate = self._fetch_list_etag, fresh = self.fresh)
+        if cached_files is not None:
+            for metadata in cached_files:
+                yield GoogleDriveFile(auth = self.drive.auth, metadata = metadata, uploaded = True)
+            return
+
+        key = self.cache.begin_listing(param)
+        file_list = self.drive.ListFile(param = param)
+        etag = None
+        position = 0
+        for page in self._pages(file_list):
+            if position == 0:
+                # the etag of the first page is what revalidation compares with
+                etag = file_list.metadata.get("etag")
+            self.cache.add_page(key, position, page)
+            position += len(page)
+            for file in page:
+                yield file
+        self.cache.finish_listing(key, etag)
+
+    def _existing_titles(self, parent, titles):
+        # the titles taken in this folder, looked up together with as few
+        # queries as the query length allows
+        existing = set()
+        clauses = ["title=%s" % requests.quote(title) for title in sorted(set(titles))]
+        for titles_query in requests.or_queries(clauses):
+            param = requests.FileListParams()
+            param["q"] = "%s in parents and trashed=false and (%s)" % (requests.quote(parent), titles_query)
+            param.set_fields(["title"])
+            existing.update(file["title"] for file in self._list_files(param))
+        return existing
+
+    def _pages(self, file_list):
+        # a page which is throttled is fetched again, since the list only
+        # moves on to the next page once a page has arrived
+        while True:
+            page = self.controller.call(next, file_list, None)
+            if page is None:
+                return
+            yield page
+
+    def _list_children(self, param, folders, q="%s"):
+        # list the children of many folders with as few requests as possible,
+        # and hand each child to the folders it is in by its parents
+        children = {folder["id"]: [] for folder in folders}
+        for parents_query in requests.parents_queries(children):
+            param = dict(param)
+            param["q"] = q % parents_query
+            for file in self._list_files(param):
+                for parent in file["parents"]:
+                    if parent["id"] in children:
+                        children[parent["id"]].append(file)
+        return children
+
+    def _list_changes(self, fields, save=True):
+        # yield the changes since this command read the changes feed last,
+        # and apply them to the metadata snapshot page by page; every command
+        # keeps its own place in the feed, saved with the last page or, if
+        # not `save`, left in self.start_page_token to be saved later
+        cache = self.cache or MetadataCache()
+        feed = ChangesFeed(auth = self.drive.auth, controller = self.controller)
+        page_token = cache.get_state(self._changes_key())
+        if page_token is None:
+            cache.set_state(self._changes_key(), self.controller.call(feed.get_start_page_token))
+            self._message("no changes have been recorded yet; changes to your google drive will be tracked from now on.")
+            return
+        fields = ["id", "title", "mimeType", "labels(trashed)"] + fields + MetadataCache.fields
+        for changes, start_page_token in feed.list_changes(page_token, fields):
+            cache.apply_changes(changes, start_page_token if save else None, self._changes_key())
+            if start_page_token is not None:
+                self.start_page_token = start_page_token
+            for change in changes:
+                yield change
+
+    def _save_start_page_token(self):
+        if self.start_page_token is not None:
+            (self.cache or MetadataCache()).set_state(self._changes_key(), self.start_page_token)
+
+    def _changes_key(self):
+        return "startPageToken:%s" % self.type
+
+    def _fetch_list_etag(self, param):
+        return self.controller.call(ListingEtag(self.drive.auth).fetch, param)
+
     @abstractmethod
     def process(self):
         pass
@@ -58,6 +233,9 @@ class Handler(ABC):
 
 
 class ListHandler(Handler):
+    # fields needed to traverse the folders regardless of the template
+    required_fields = ["id", "title", "mimeType", "ownedByMe", "parents(id)"]
+
     def __init__(self):
         super().__init__("list")
         self.request_params = requests.FileListParams()
@@ -66,15 +244,31 @@ class ListHandler(Handler):
     def process(self, options):
         # Display options
         self.recursive = options.recursive
+        self.jobs = options.jobs
+        self.changed = options.changed_since_last_run
         if options.time:
             self.request_params["orderBy"] += ",modifiedDate"
         if options.fields:
             fields = [i.strip() for i in options.fields.strip().split(",")]
-            self.formatter.template = "\n".join("%-10s: {%s}" % (i.upper(), i) for i in fields) + "\n"
+            template = formatter.fields_template(fields)
         elif options.long:
-            self.formatter.template = "{id:40}\t{ownerNames[0]:10}\t{fileSize:>10}\t{modifiedDate}\t{title:20}"
+            template = formatter.LONG_TEMPLATE
+        else:
+            template = formatter.DEFAULT_TEMPLATE
+        if options.format == "text":
+            self.formatter = Formatter(template)
         else:
-            self.formatter.template = "{id:40}\t{title:20}"
+            # the records hold exactly the fields of the template, and the
+            # folder of each file when listing recursively
+            columns = formatter.template_fields(template) + (["path"] if self.recursive else [])
+            self.formatter = RecordFormatter(options.format, columns)
+        if options.fields_mask:
+            fields = options.fields_mask.split(",")
+        else:
+            fields = self.formatter.fields()
+        self.fields = self.required_fields + fields
+        self._open_cache(options)
+        self.request_params.set_fields(self.fields + self._cache_fields())
 
         # File Filter Options
         if options.query:
@@ -82,59 +276,88 @@ class ListHandler(Handler):
         elif options.all:
             q = "'root' in parents or sharedWithMe and trashed=false"
         elif options.filename or options.id:
+            ids = self._resolve(options.id or [])
             if options.filename and not options.id:
                 q = " or ".join(["title='%s'" % fname.strip() for fname in options.filename])
             elif options.id and not options.filename:
-                q = " or ".join(["'%s' in parents" % id.strip() for id in options.id])
+                q = " or ".join(["'%s' in parents" % id for id in ids])
             else:
-                q_ids = " or ".join(["'%s' in parents" % id.strip() for id in options.id])
+                q_ids = " or ".join(["'%s' in parents" % id for id in ids])
                 q_filenames = " or ".join(["title='%s'" % fname.strip() for fname in options.filename])
                 q = q_ids + " or " + q_filenames
         else:
             q = "'root' in parents and trashed=false"
         self.request_params["q"] = q
 
-    def _execute(self, folders, queue):
-        item = queue.get()
-        parent_folder = item["parent_folder"]
-        child_folder = item["child_folder"]
-        param = self.request_params.copy()
-        param.update({"q": "'%s' in parents and trashed=false" % child_folder["id"]})
-        for f in self.drive.ListFile(param = param).GetList():
-            folders["%s/%s" % (parent_folder, child_folder["title"])].append(f)
-            if f["mimeType"] == "application/vnd.google-apps.folder":
-                queue.put({
-                    "parent_folder": "%s/%s" % (parent_folder, child_folder["title"]),
-                    "child_folder": f
-                })
+    def _list_folders(self, folders):
+        return self._list_children(self.request_params, folders, "(%s) and trashed=false")
 
     def execute(self):
-        if self.recursive:
-            q = Queue()
+        try:
+            self._display()
+        finally:
+            self.formatter.flush()
+
+    def _display(self):
+        if self.changed:
+            for change in self._list_changes(self.fields):
+                if is_removed(change):
+                    self.formatter.message("removed %s" % change["fileId"])
+                else:
+                    self.formatter.display(change["file"])
+        elif self.recursive:
+            # records carry their folders, so they can be written as soon as
+            # they arrive instead of being grouped by folder first
+            streaming = isinstance(self.formatter, RecordFormatter)
+            roots = []
             folders = defaultdict(list)
-            for f in self.drive.ListFile(param = self.request_params).GetList():
-                if f.get("mimeType") == "application/vnd.google-apps.folder" and f.get("ownedByMe"):
-                    q.put({"parent_folder": "./MyDrive", "child_folder": f})
-                if f.get("ownedByMe"):
-                    folders["./MyDrive"].append(f)
+            for f in self._list_files(self.request_params):
+                if f.get("mimeType") == FOLDER_MIMETYPE and f.get("ownedByMe"):
+                    roots.append(("./MyDrive/%s" % f["title"], f))
+                path = "./MyDrive" if f.get("ownedByMe") else "./ShareWithMe"
+                if streaming:
+                    self.formatter.folder(path)
+                    self.formatter.display(f)
                 else:
-                    folders["./ShareWithMe"].append(f)
-
-            while not q.empty():
-                self._execute(folders, q)
+                    folders[path].append(f)
+
+            walker = FolderWalker(self._list_folders, jobs = self.jobs, batch_size = requests.FOLDERS_PER_QUERY)
+            try:
+                for path, folder, children in walker.walk(roots):
+                    if streaming:
+                        self.formatter.folder(path)
+                    for f in children:
+                        if streaming:
+                            self.formatter.display(f)
+                        else:
+                            folders[path].append(f)
+                        if f["mimeType"] == FOLDER_MIMETYPE:
+                            walker.push("%s/%s" % (path, f["title"]), f)
+            except ApiRequestError as e:
+                print("error: cannot list the files in your google drive; %s" % str(e))
+                sys.exit(1)
 
             for folder, items in folders.items():
-                texts.FolderText(folder).add_prefix("\n").add_suffix(":").show()
+                self.formatter.folder(folder)
                 for f in items:
                     self.formatter.display(f)
         else:
-            for f in self.drive.ListFile(param = self.request_params).GetList():
+            for f in self._list_files(self.request_params):
                 self.formatter.display(f)
 
 
 class DownloadHandler(Handler):
+    # fields needed to decide whether and how a file can be downloaded
+    required_fields = ["id", "title", "mimeType", "capabilities(canDownload)", "exportLinks", "parents(id)", "headRevisionId", "version"]
+    fields = ["md5Checksum", "fileSize"]
+    # fields needed to tell whether a local copy is up to date
+    update_fields = ["md5Checksum", "fileSize", "modifiedDate"]
+    # fields kept in the journal, which are all a resumed download needs
+    journal_fields = ["id", "fileSize", "md5Checksum", "headRevisionId", "version"]
+
     def __init__(self):
         super().__init__("download")
+        self.fresh = True
         try:
             config = utils.load_configuration()
         except FileNotFoundError:
@@ -144,7 +367,13 @@ class DownloadHandler(Handler):
             self.download_path = Path(config["root"], config["downloads"])
         self.request_params = requests.FileListParams()
         self.export_format = None
-        self.files = []
+        self.transfers = None
+        self.digests = None
+        self.blobs = None
+        self.up_to_date = 0
+        # the files downloaded so far, or being downloaded, by their contents
+        self.contents = {}
+        self.contents_lock = threading.Lock()
 
     def process(self, options):
         # process export options
@@ -168,51 +397,241 @@ class DownloadHandler(Handler):
         else:
             q = "'root' in parents and trashed=false"
         self.request_params["q"] = q
+        if options.fields_mask:
+            fields = options.fields_mask.split(",")
+        else:
+            fields = self.fields
+        if options.update:
+            fields = fields + self.update_fields
+            self.digests = DigestCache()
+        self._open_cache(options)
+        self.request_params.set_fields(self.required_fields + fields + self._cache_fields())
+        if not options.no_cache:
+            self.blobs = BlobCache()
+
+        # process download options; the journal keeps the absolute path so
+        # that the job can be resumed from any directory
+        self.download_path = Path(options.path or self.download_path).absolute()
+        self.jobs = options.jobs
+        self.order = options.order
+        self.segments = options.segments
 
-        # process download options
-        self.download_path = Path(options.path or self.download_path)
-
-        # add download task to self.files
-        self._add_download_tasks(
-            self.request_params,
-            self.download_path,
-            options.recursive,
-            options.force
-        )
+        self.recursive = options.recursive
+        self.force = options.force
+        self.changed_fields = self.required_fields + fields if options.changed_since_last_run else None
+        if self.journal is None:
+            self.journal = Journal.create(self.type, dict(vars(options), path = str(self.download_path)))
+
+    def resume(self, journal):
+        self.journal = journal
+        # the files done before the job was interrupted are skipped and the
+        # folders it created are descended into; everything else is checked
+        # as the job did in the first place
+        self.process(Namespace(**journal.options))
 
     def execute(self):
-        for file in self.files:
-            progress_bar = tqdm(
-                desc = "%s" % file["title"],
-                total = 100,
-                ncols = 100,
-                ascii = True,
-                bar_format = "  {desc:<20}: |{bar}| {n_fmt:>3}/{total_fmt:>3}"
-            )
-            threading.Thread(
-                target = file["file"].GetContentFile,
-                args = (file["path"] / file["title"],),
-                kwargs = {"mimetype": file["export_format"], "callback": self._update_progress_bar(progress_bar)}
-            ).start()
+        # the files are downloaded while the folders are still being listed
+        self.progress = ProgressDisplay("downloaded")
+        listed = True
+        try:
+            with self.progress, TransferQueue(self.download, jobs = self.jobs) as self.transfers:
+                if self.journal.planned_all:
+                    # every file of the job is known; the remote tree is not
+                    # listed again
+                    self.start_page_token = self.journal.state.get("startPageToken")
+                    for record in self.journal.remaining():
+                        self._queue_download(self._task(record))
+                else:
+                    self._discover()
+                    self.journal.mark_planned_all(startPageToken = self.start_page_token)
+        except ApiRequestError as e:
+            print("error: cannot list the files in your google drive; %s" % str(e))
+            listed = False
+        finally:
+            self.journal.close()
+            if self.up_to_date:
+                print("%d files are up to date" % self.up_to_date)
+            print(self.progress.report())
+            if self.journal.path.exists():
+                print("the rest of this job can be resumed with 'gdrive resume %s'" % self.journal.id)
+        if self.progress.failures or not listed:
+            sys.exit(1)
+        self._save_start_page_token()
+
+    def _task(self, record):
+        return {
+            "file": GoogleDriveFile(auth = self.drive.auth, metadata = record["file"], uploaded = True),
+            "title": record["title"],
+            "export_format": record["export_format"],
+            "path": Path(record["path"])
+        }
 
-    def _update_progress_bar(self, progress_bar):
-        def _update(x, total):
-            if (total == 0.0 and x == 0.0) or total is None:
-                steps = 100
+    def _discover(self):
+        if self.changed_fields is not None:
+            files = self._changed_files(self.changed_fields)
+        else:
+            files = self._list_files(self.request_params)
+        folders = self._add_download_tasks(files, self.download_path, self.recursive, self.force)
+        walker = FolderWalker(self._list_folders, jobs = self.jobs, batch_size = requests.FOLDERS_PER_QUERY)
+        for folder_name, folder, children in walker.walk(folders):
+            for subfolder in self._add_download_tasks(children, folder_name, self.recursive, self.force):
+                walker.push(*subfolder)
+
+    def _queue_download(self, task):
+        self.journal.plan(str(task["path"] / task["title"]), {
+            "file": {field: task["file"][field] for field in self.journal_fields if task["file"].get(field) is not None},
+            "title": task["title"],
+            "export_format": task["export_format"],
+            "path": str(task["path"])
+        })
+        # files with the same content are downloaded once, and the other
+        # copies are linked to the first copy once it has been downloaded
+        key = self._content_key(task["file"], task["export_format"])
+        if key is not None:
+            # whether to link now or to wait for the first copy is decided
+            # under the lock, since the first copy may finish meanwhile
+            source = None
+            with self.contents_lock:
+                content = self.contents.get(key)
+                if content is None:
+                    self.contents[key] = {"path": None, "waiting": []}
+                elif content["path"] is None:
+                    content["waiting"].append(task)
+                else:
+                    source = content["path"]
+            if content is not None:
+                self.progress.queued(0)
+                if source is not None:
+                    self._link_duplicate(source, task)
+                return
+
+        # only the files waiting in the queue can be ordered by size; exported
+        # documents have no size until they are exported
+        size = int(task["file"].get("fileSize") or 0)
+        self.progress.queued(size)
+        self.transfers.put(task, priority = {"largest": -size, "smallest": size}.get(self.order, 0))
+
+    @staticmethod
+    def _content_key(file, export_format=None):
+        if export_format is not None or not file.get("md5Checksum") or not int(file.get("fileSize") or 0):
+            return None
+        return file["md5Checksum"], int(file["fileSize"])
+
+    def download(self, file):
+        succeeded = self._transfer(file)
+        key = self._content_key(file["file"], file["export_format"])
+        if key is None:
+            return
+        retry = None
+        with self.contents_lock:
+            content = self.contents[key]
+            if succeeded:
+                content["path"] = file["path"] / file["title"]
+                waiting, content["waiting"] = content["waiting"], []
+            elif content["waiting"]:
+                # download another copy of the content instead
+                retry = content["waiting"].pop(0)
             else:
-                steps = int(x/total*100 - progress_bar.n)
-            progress_bar.update(steps)
-        return _update
-
-    def _add_download_tasks(self, request_params, download_path, recursive, force):
+                del self.contents[key]
+        if retry is not None:
+            self.download(retry)
+        elif succeeded:
+            for duplicate in waiting:
+                self._link_duplicate(content["path"], duplicate)
+
+    def _link_duplicate(self, source, task):
+        path = task["path"] / task["title"]
+        try:
+            link(source, path)
+        except OSError as e:
+            self.progress.failed(task["title"], e)
+            self.journal.mark_failed(str(path), e)
+        else:
+            self.progress.linked(int(task["file"]["fileSize"]))
+            self.journal.mark_done(str(path))
+
+    def _transfer(self, file):
+        path = file["path"] / file["title"]
+        size = file["file"].get("fileSize")
+        transfer = self.progress.begin(file["title"], int(size) if size is not None else None)
+        # the same revision exported to the same format is the same content
+        key = self.blobs.key(file["file"], file["export_format"]) if self.blobs is not None else None
+        try:
+            if key is not None and self.blobs.get(key, path):
+                transfer.update(path.stat().st_size, path.stat().st_size)
+                self.progress.done(transfer.done, cached = True)
+                self.journal.mark_done(str(path))
+                return True
+            if file["export_format"] is None:
+                self._download_content(file["file"], path, transfer.update)
+            else:
+                # exports are written aside and moved in place once complete
+                export = Path("%s%s" % (path, PART_SUFFIX))
+                self.controller.call(file["file"].GetContentFile, export, mimetype = file["export_format"], callback = transfer.update)
+                os.replace(export, path)
+            if key is not None:
+                self.blobs.put(key, path)
+        except (ApiRequestError, FileNotDownloadableError, ChecksumError, OSError) as e:
+            self.progress.failed(file["title"], e)
+            self.journal.mark_failed(str(path), e)
+            return False
+        else:
+            transfer.update(path.stat().st_size, path.stat().st_size)
+            self.progress.done(transfer.done)
+            self.journal.mark_done(str(path))
+            return True
+        finally:
+            self.progress.end(transfer)
+
+    def _download_content(self, file, path, callback):
+        # files which are not google workspace documents can be resumed from
+        # a .part file as long as their content has not changed since
+        revision = file.get("headRevisionId") or file.get("md5Checksum")
+        size = int(file["fileSize"]) if file.get("fileSize") is not None else None
+        # only split the files which are large enough for every segment to
+        # be worth a connection of its own
+        segments = min(self.segments, (size or 0) // MIN_SEGMENT_SIZE)
+        if segments > 1:
+            download = SegmentedDownload(file.auth, MEDIA_URL % file["id"], path, revision, size, file.get("md5Checksum"), segments, controller = self.controller)
+        else:
+            download = ResumableDownload(file.auth, MEDIA_URL % file["id"], path, revision, size, controller = self.controller)
+        download.run(callback = callback)
+
+    def _changed_files(self, fields):
+        # the place in the changes feed is saved once the files are downloaded
+        for change in self._list_changes(fields, save = False):
+            if not is_removed(change):
+                yield GoogleDriveFile(auth = self.drive.auth, metadata = change["file"], uploaded = True)
+
+    def _list_folders(self, folders):
+        return self._list_children(self.request_params, folders)
+
+    def _is_up_to_date(self, file, path):
+        if not path.is_file():
+            return False
+        stat = path.stat()
+        if file.get("md5Checksum") is not None:
+            if file.get("fileSize") is not None and int(file["fileSize"]) != stat.st_size:
+                return False
+            return self.digests.md5(path) == file["md5Checksum"]
+        # google workspace documents have no checksum; the local copy is up
+        # to date unless the document has been modified after it was written
+        if file.get("modifiedDate") is None:
+            return False
+        modified = datetime.fromisoformat(file["modifiedDate"].replace("Z", "+00:00"))
+        return modified.timestamp() <= stat.st_mtime
+
+    def _add_download_tasks(self, files, download_path, recursive, force):
+        # returns the folders to download next
         _filenames = []
-        for file in self.drive.ListFile(param = request_params).GetList():
+        folders = []
+        for file in files:
             mimetype = file["mimeType"]
             # some shared files cannot be downloaded because the owner
             # does not allow you to do so
             capabilities = file["capabilities"]
             if not capabilities["canDownload"]:
-                print("error: '%s' cannot be downloaded; probably you don't have permission to do so" % file["title"])
+                self._message("error: '%s' cannot be downloaded; probably you don't have permission to do so" % file["title"])
                 continue
 
             # cache filenames and check if there are duplicated names,
@@ -223,63 +642,78 @@ class DownloadHandler(Handler):
             else:
                 _filenames.append(title)
 
-            # file / folder already exists
-            if Path(download_path, title).exists() and not force:
-                print("error: '%s' cannot be downloaded because it already exists; skipping..." % title)
+            # downloaded before this job was interrupted
+            if str(Path(download_path, title)) in self.journal.done:
                 continue
 
+            # file / folder already exists, other than a folder this job
+            # created before it was interrupted
+            path = Path(download_path, title)
+            if path.exists() and not force and "folder:%s" % path not in self.journal.done:
+                if self.digests is None:
+                    self._message("error: '%s' cannot be downloaded because it already exists; skipping..." % title)
+                    continue
+                # with --update, only the files which differ are downloaded
+                # again and existing folders are descended into
+                if mimetype != FOLDER_MIMETYPE and self._is_up_to_date(file, Path(download_path, title)):
+                    self.up_to_date += 1
+                    # the local copy can be linked to by other copies
+                    key = self._content_key(file)
+                    if key is not None:
+                        with self.contents_lock:
+                            self.contents.setdefault(key, {"path": Path(download_path, title), "waiting": []})
+                    continue
+
             if not mimetype.startswith("application/vnd.google-apps."):
                 # a file
                 export_format = None
             elif mimetype.startswith("application/vnd.google-apps.folder") and not recursive:
                 # a folder but not download
-                print("error: -r not specified; omitting folder '%s/'" % title)
+                self._message("error: -r not specified; omitting folder '%s/'" % title)
                 continue
             elif mimetype.startswith("application/vnd.google-apps.folder") and recursive:
                 # a folder and download recursively
-                request_params = self.request_params.copy()
-                request_params["q"] = "'%s' in parents" % file["id"]
                 folder_name = Path(download_path, title)
                 folder_name.mkdir(exist_ok = True) # if the folder already exists, it will be bait out already in previous sanity check
-                self._add_download_tasks(request_params, folder_name, recursive, force)
+                self.journal.mark_done("folder:%s" % folder_name)
+                folders.append((folder_name, file))
                 continue # skip this task since it is only a folder
             else:
                 # a google workspace document
                 if self.export_format is None:
                     exportable_mimetypes = file["exportLinks"].keys()
-                    export_format = input("\n-- Choose an export mimetype for '%s':\n%s\n>> " % (title, "\n".join(exportable_mimetypes))).strip()
-                    while export_format not in exportable_mimetypes:
-                        print(">> Invalid mimetype: %s" % export_format)
-                        export_format = input(">> ")
+                    with self.progress.paused():
+                        export_format = input("\n-- Choose an export mimetype for '%s':\n%s\n>> " % (title, "\n".join(exportable_mimetypes))).strip()
+                        while export_format not in exportable_mimetypes:
+                            print(">> Invalid mimetype: %s" % export_format)
+                            export_format = input(">> ")
                 else:
                     export_format = self.export_format[mimetype]
 
-            self.files.append({
+            self._queue_download({
                 "file": file,
                 "title": title,
                 "export_format": export_format,
                 "path": download_path
             })
+        return folders
 
 
 class UploadHandler(Handler):
-    def __init__(self):
-        super().__init__("upload")
-        self.metadatas = []
-        self.paths = defaultdict(list)
-
-    def _add_path(self, path, rename=False, id="root"):
-        if path.is_dir():
-            folder = self.drive.CreateFile(metadata = {
-                "title": rename or path.name,
-                "parents": [{"id": id}],
-                "mimeType": "application/vnd.google-apps.folder"
-            })
-            folder.Upload()
-            for filename in path.iterdir():
-                self._add_path(Path(filename), id = folder["id"])
-        else:
-            self.paths[id].append((rename, path))
+    def __init__(self, type="upload"):
+        super().__init__(type)
+        self.fresh = True
+        # the folders to upload as (title, path, parent id, id) where id is
+        # the one reserved before the job was resumed, and the files as
+        # (title, path, parent id, id) where id is that of the file updated
+        self.files = []
+        self.folders = []
+        self.chunk_size = uploads.CHUNK_SIZE
+        self.jobs = 4
+        self.order = "largest"
+        self.transfers = None
+        self.invalidated = set()
+        self.up_to_date = 0
 
     def process(self, options):
         if options.rename and len(options.rename) != len(options.filename):
@@ -290,32 +724,327 @@ class UploadHandler(Handler):
         else:
             name_pairs = zip(options.filename, options.filename)
 
+        self._open_cache(options)
+        self.chunk_size = uploads.chunk_size(options.chunk_size)
+        self.jobs = options.jobs
+        self.order = options.order
+        root = self._resolve([options.root])[0]
+        self.journal = Journal.create(self.type, vars(options))
+        candidates = []
         for rename, filename in name_pairs:
-            rename = Path(rename).name
             path = Path(filename)
             if not path.exists():
                 print("error: No such file or folder: '%s', skipping..." % path)
                 continue
-            if not options.allow_duplicate:
-                param = requests.FileListParams()
-                param["q"] = "'%s' in parents and trashed=false and title='%s'" % (options.root, rename)
-                files = list(self.drive.ListFile(param = param).GetList())
-                if len(files) > 0:
-                    print("error: '%s' already exists in your google drive." % rename)
-                    continue
-            self._add_path(path, rename = rename, id = options.root)
+            candidates.append((Path(rename).name, path))
+        existing = set()
+        if not options.allow_duplicate:
+            existing = self._existing_titles(root, [rename for rename, _ in candidates])
+        for rename, path in candidates:
+            if rename in existing:
+                print("error: '%s' already exists in your google drive." % rename)
+                continue
+            if path.is_dir():
+                self.folders.append(self._plan_folder(rename, path, root))
+            else:
+                self.files.append((rename, path, root, None))
+
+    def resume(self, journal):
+        # only the files and folders left are uploaded, and the folders which
+        # were created are not created again
+        self.journal = journal
+        options = Namespace(**journal.options)
+        self._open_cache(options)
+        self.chunk_size = uploads.chunk_size(options.chunk_size)
+        self.jobs = options.jobs
+        self.order = options.order
+        for record in journal.remaining():
+            path = Path(record["path"])
+            if not record.get("folder"):
+                self.files.append((record["title"], path, record["parent"], record.get("id")))
+                continue
+            # a folder which was given an id is inserted with the same id, so
+            # it is not created twice if it was created before
+            item = self._folder_item(record["parent"], record["title"])
+            self.folders.append((record["title"], path, record["parent"], journal.folder_ids.get(item)))
 
     def execute(self):
-        for id, files in self.paths.items():
-            for rename, path in files:
-                file = self.drive.CreateFile(metadata = {
-                    "title" : rename or path.name,
-                    "parents" : [{"id": id}]
-                })
-                file.SetContentFile(path)
-                threading.Thread(
-                    target = file.Upload
-                ).start()
+        # the files are uploaded while the folders are still being created
+        self.progress = ProgressDisplay("uploaded")
+        created = True
+        try:
+            with self.progress, TransferQueue(self.upload, jobs = self.jobs) as self.transfers:
+                for title, path, parent, id in self.files:
+                    self._queue_upload(title, path, parent, id)
+                self._plan()
+                if not self.journal.planned_all:
+                    self.journal.mark_planned_all()
+        except ApiRequestError as e:
+            print("error: cannot list or create the folders in your google drive; %s" % str(e))
+            created = False
+        finally:
+            self.journal.close()
+            if self.up_to_date:
+                print("%d files are up to date" % self.up_to_date)
+            print(self.progress.report())
+            if self.journal.path.exists():
+                print("the rest of this job can be resumed with 'gdrive resume %s'" % self.journal.id)
+        if self.progress.failures or not created:
+            sys.exit(1)
+
+    def _plan(self):
+        self._create_folders(self.folders)
+
+    def _create_folders(self, folders):
+        # the folders of a level are created concurrently with ids reserved
+        # in bulk; the files of a folder are queued as soon as it exists, and
+        # its subfolders make up the next level
+        generator = IdGenerator(self.drive.auth, self.controller)
+        with ThreadPoolExecutor(max_workers = self.jobs) as executor:
+            while folders:
+                ids = iter(generator.generate(sum(1 for folder in folders if folder[3] is None)))
+                futures = {}
+                for title, path, parent, id in folders:
+                    item = self._folder_item(parent, title)
+                    if id is None:
+                        # the id is recorded before the folder is created
+                        id = next(ids)
+                        self.journal.mark_reserved(item, id)
+                    self._invalidate(parent)
+                    futures[executor.submit(self._create_folder, id, title, parent)] = (item, id, path)
+                folders = []
+                for future in as_completed(futures):
+                    item, id, path = futures[future]
+                    try:
+                        future.result()
+                    except ApiRequestError as e:
+                        # nothing below this folder can be uploaded
+                        self.progress.failed(str(path), e)
+                        continue
+                    self._queue_contents(item, id, path, folders)
+
+    def _queue_contents(self, item, id, path, folders):
+        # queue the files of a folder which exists and add its subfolders to
+        # the next level; what the journal has planned already is left to it
+        try:
+            entries = list(os.scandir(path))
+        except OSError as e:
+            self.progress.failed(str(path), e)
+            return
+        for entry in entries:
+            if entry.is_dir():
+                if self._folder_item(id, entry.name) not in self.journal.planned:
+                    folders.append(self._plan_folder(entry.name, Path(entry.path), id))
+            elif self._item({"title": entry.name, "parents": [{"id": id}]}) not in self.journal.planned:
+                self._queue_upload(entry.name, Path(entry.path), id)
+        # every child of the folder is in the journal now
+        self.journal.mark_done(item)
+
+    def _plan_folder(self, title, path, parent):
+        self.journal.plan(self._folder_item(parent, title), {"parent": parent, "title": title, "path": str(path.absolute()), "folder": True})
+        return title, path, parent, None
+
+    @staticmethod
+    def _folder_item(parent, title):
+        return "folder:%s/%s" % (parent, title)
+
+    def _create_folder(self, id, title, parent):
+        try:
+            FolderInsert(self.drive.auth, self.controller).run(id, title, parent)
+        except ApiRequestError as e:
+            # created by an attempt whose response was lost
+            if e.error.get("code") != 409:
+                raise
+
+    def _queue_upload(self, title, path, parent, id=None):
+        self._invalidate(parent)
+        task = {
+            "metadata": {
+                "title" : title,
+                "parents" : [{"id": parent}]
+            },
+            "path": path,
+            "id": id
+        }
+        self.journal.plan(self._item(task["metadata"]), {"parent": parent, "title": title, "path": str(path.absolute()), "id": id})
+        try:
+            stat = path.stat()
+        except OSError as e:
+            self._failed(task, e)
+            return
+        task["size"] = stat.st_size
+        task["metadata"].update(self._metadata(stat))
+        # only the files waiting in the queue can be ordered by size
+        self.progress.queued(task["size"])
+        self.transfers.put(task, priority = {"largest": -task["size"], "smallest": task["size"]}.get(self.order, 0))
+
+    def _metadata(self, stat):
+        # the metadata of an uploaded file besides its title and parents
+        return {}
+
+    def _invalidate(self, id):
+        if self.cache is not None and id not in self.invalidated:
+            self.cache.invalidate(id)
+            self.invalidated.add(id)
+
+    def upload(self, task):
+        metadata = task["metadata"]
+        transfer = self.progress.begin(metadata["title"], task["size"])
+        try:
+            # an upload interrupted before is continued from its last chunk
+            upload = ResumableUpload(self.drive.auth, task["path"], metadata, self.chunk_size, controller = self.controller, id = task["id"])
+            upload.run(callback = transfer.update)
+        except (ApiRequestError, OSError) as e:
+            self._failed(task, e)
+        else:
+            transfer.update(task["size"], task["size"])
+            self.progress.done(task["size"])
+            self.journal.mark_done(self._item(metadata))
+            self._message("uploaded '%s' (%s)" % (task["path"], texts.format_bytes(task["size"])))
+        finally:
+            self.progress.end(transfer)
+
+    def _failed(self, task, error):
+        self.progress.failed(str(task["path"]), error)
+        self.journal.mark_failed(self._item(task["metadata"]), error)
+
+    @staticmethod
+    def _item(metadata):
+        return "%s/%s" % (metadata["parents"][0]["id"], metadata["title"])
+
+
+class SyncHandler(UploadHandler):
+    # fields needed to tell whether a remote file is a copy of a local file
+    fields = ["id", "title", "mimeType", "fileSize", "md5Checksum", "modifiedDate", "parents(id)"]
+
+    def __init__(self):
+        super().__init__("sync")
+        self.request_params = requests.FileListParams()
+        self.local = None
+        self.root = None
+        self.digests = None
+        self.delete = False
+
+    def process(self, options):
+        self.local = Path(options.local).absolute()
+        if not self.local.is_dir():
+            print("error: No such folder: '%s'" % options.local)
+            sys.exit(1)
+        self._open_cache(options)
+        self.chunk_size = uploads.chunk_size(options.chunk_size)
+        self.jobs = options.jobs
+        self.order = options.order
+        self.delete = options.delete
+        if not options.no_cache:
+            self.digests = DigestCache()
+        self.root = self._resolve([options.remote])[0]
+        self.request_params.set_fields(self.fields + self._cache_fields())
+        self.journal = Journal.create(self.type, dict(vars(options), local = str(self.local), remote = self.root))
+
+    def resume(self, journal):
+        super().resume(journal)
+        if journal.planned_all:
+            return
+        # the comparison was interrupted; it is run again, which is cheap as
+        # the files uploaded since carry the mtime of their local copy, and
+        # what the journal has planned already is left to it
+        options = Namespace(**journal.options)
+        self.local = Path(options.local)
+        self.root = options.remote
+        self.delete = options.delete
+        if not options.no_cache:
+            self.digests = DigestCache()
+        self.request_params.set_fields(self.fields + self._cache_fields())
+
+    def _plan(self):
+        # a job resumed once it was planned only uploads what it had planned
+        if self.local is None:
+            return super()._plan()
+        walker = FolderWalker(self._list_folders, jobs = self.jobs, batch_size = requests.FOLDERS_PER_QUERY)
+        for path, folder, children in walker.walk([(self.local, {"id": self.root})]):
+            for subfolder in self._compare(path, folder["id"], children):
+                walker.push(*subfolder)
+        # the folders missing remotely are uploaded with everything in them
+        self._create_folders(self.folders)
+
+    def _list_folders(self, folders):
+        return self._list_children(self.request_params, folders, "(%s) and trashed=false")
+
+    def _compare(self, local, parent, children):
+        # queue what differs between a local folder and its remote copy;
+        # returns the subfolders to compare next
+        remote = defaultdict(list)
+        for file in children:
+            remote[file["title"]].append(file)
+        try:
+            entries = list(os.scandir(local))
+        except OSError as e:
+            self.progress.failed(str(local), e)
+            return []
+        subfolders = []
+        for entry in entries:
+            path = Path(entry.path)
+            files = remote.pop(entry.name, [])
+            if self._folder_item(parent, entry.name) in self.journal.planned or self._item({"title": entry.name, "parents": [{"id": parent}]}) in self.journal.planned:
+                continue
+            if len(files) > 1:
+                self.progress.failed(str(path), "it matches the files with ids: %s" % ", ".join(file["id"] for file in files))
+                continue
+            file = files[0] if files else None
+            if entry.is_dir():
+                if file is None:
+                    self.folders.append(self._plan_folder(entry.name, path, parent))
+                elif file["mimeType"] == FOLDER_MIMETYPE:
+                    subfolders.append((path, file))
+                else:
+                    self.progress.failed(str(path), "the file %s is in the way of this folder" % file["id"])
+            elif file is None:
+                self._queue_upload(entry.name, path, parent)
+            elif file["mimeType"] == FOLDER_MIMETYPE or not file.get("md5Checksum"):
+                # folders and google workspace documents have no content to
+                # compare with
+                self.progress.failed(str(path), "the file %s cannot be replaced by this file" % file["id"])
+            else:
+                try:
+                    up_to_date = self._is_up_to_date(path, file)
+                except OSError as e:
+                    self.progress.failed(str(path), e)
+                    continue
+                if up_to_date:
+                    self.up_to_date += 1
+                else:
+                    self._queue_upload(entry.name, path, parent, file["id"])
+        if self.delete:
+            for files in remote.values():
+                for file in files:
+                    self._trash(file, local / file["title"])
+        return subfolders
+
+    def _is_up_to_date(self, path, file):
+        stat = path.stat()
+        if file.get("fileSize") is None or int(file["fileSize"]) != stat.st_size:
+            return False
+        # the files uploaded by sync keep the mtime of their local copy, so a
+        # file whose mtime has not changed since is not hashed at all
+        modified = datetime.fromisoformat(file["modifiedDate"].replace("Z", "+00:00"))
+        if abs(modified.timestamp() - stat.st_mtime) < 0.001:
+            return True
+        md5 = self.digests.md5(path) if self.digests is not None else file_md5(path)
+        return md5 == file["md5Checksum"]
+
+    def _trash(self, file, path):
+        try:
+            self.controller.call(file.Trash)
+        except ApiRequestError as e:
+            self.progress.failed(str(path), e)
+        else:
+            self._forget_paths(file["id"])
+            self._message("trashed '%s'" % path)
+
+    def _metadata(self, stat):
+        # milliseconds are all the modified date of a file keeps
+        modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        return {"modifiedDate": modified.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"}
 
 
 class CreateHandler(Handler):
@@ -331,24 +1060,23 @@ class CreateHandler(Handler):
         self.contents = options.contents or self.contents
         self.metadata["title"] = options.filename or self.metadata["title"]
         self.metadata["mimeType"] = "text/plain" if self.contents else "application/vnd.google-apps.folder"
-        self.metadata["parents"] = {"id": options.root.strip(" /")}
-        if not options.allow_duplicate:
-            param = requests.FileListParams()
-            param["q"] = "'%s' in parents and trashed=false and title='%s'" % (options.root.strip(" /"), options.filename)
-            files = list(self.drive.ListFile(param = param).GetList())
-            if len(files) > 0:
-                print("error: '%s' already exists in your google drive." % options.filename)
-                sys.exit()
+        self._open_cache(options)
+        self.metadata["parents"] = {"id": self._resolve([options.root.strip(" /")])[0]}
+        if not options.allow_duplicate and self._existing_titles(self.metadata["parents"]["id"], [self.metadata["title"]]):
+            print("error: '%s' already exists in your google drive." % self.metadata["title"])
+            sys.exit()
 
     def execute(self):
         file = self.drive.CreateFile(metadata = self.metadata)
         if self.contents:
             file.SetContentString(self.contents)
-        file.Upload()
+        self.controller.call(file.Upload)
+        if self.cache is not None:
+            self.cache.invalidate(self.metadata["parents"]["id"])
 
     def upload(self, file):
         try:
-            file.Upload()
+            self.controller.call(file.Upload)
         except ApiRequestError as e:
             print("error: cannot upload this file %s; %s" % (file["id"], str(e)))
         else:
@@ -358,9 +1086,11 @@ class CreateHandler(Handler):
 class TrashHandler(Handler):
     def __init__(self):
         super().__init__("trash")
+        self.fresh = True
 
     def process(self, options):
-        self.ids = [id.strip() for id in options.ids]
+        self._open_cache(options)
+        self.ids = self._resolve(options.ids)
 
     def execute(self):
         for id in self.ids:
@@ -372,10 +1102,11 @@ class TrashHandler(Handler):
 
     def trash(self, file):
         try:
-            file.Trash()
+            self.controller.call(file.Trash)
         except ApiRequestError as e:
             print("error: cannot trash this file %s; %s" % (file["id"], str(e)))
         else:
+            self._forget_paths(file["id"])
             print("trashed %s" % file["id"])
 
 
@@ -384,7 +1115,8 @@ class UnTrashHandler(Handler):
         super().__init__("untrash")
 
     def process(self, options):
-        self.ids = [id.strip() for id in options.ids]
+        self._open_cache(options)
+        self.ids = self._resolve(options.ids)
 
     def execute(self):
         for id in self.ids:
@@ -396,7 +1128,7 @@ class UnTrashHandler(Handler):
 
     def untrash(self, file):
         try:
-            file.UnTrash()
+            self.controller.call(file.UnTrash)
         except ApiRequestError as e:
             print("error: cannot untrash this file %s; %s" % (file["id"], str(e)))
         else:
@@ -406,9 +1138,11 @@ class UnTrashHandler(Handler):
 class DeleteHandler(Handler):
     def __init__(self):
         super().__init__("delete")
+        self.fresh = True
 
     def process(self, options):
-        self.ids = [id.strip() for id in options.ids]
+        self._open_cache(options)
+        self.ids = self._resolve(options.ids)
 
     def execute(self):
         for id in self.ids:
@@ -420,25 +1154,28 @@ class DeleteHandler(Handler):
 
     def delete(self, file):
         try:
-            file.Delete()
+            self.controller.call(file.Delete)
         except ApiRequestError as e:
             print("error: cannot delete this file %s; %s" % (file["id"], str(e)))
         else:
+            self._forget_paths(file["id"])
             print("delete %s" % file["id"])
 
 
 class MoveHandler(Handler):
     def __init__(self):
         super().__init__("move")
+        self.fresh = True
 
     def process(self, options):
-        self.sources = options.sources
-        self.destination = options.destination
+        self._open_cache(options)
+        ids = self._resolve(options.sources + [options.destination])
+        self.sources, self.destination = ids[:-1], ids[-1]
 
     def execute(self):
         for source in self.sources:
             source_file = self.drive.CreateFile(metadata = {"id": source})
-            source_file.FetchMetadata(fields = "id,parents")
+            self.controller.call(source_file.FetchMetadata, fields = "id,parents")
             threading.Thread(
                 target = self.move,
                 args = (source_file, ",".join(parent["id"] for parent in source_file["parents"]))
@@ -446,27 +1183,30 @@ class MoveHandler(Handler):
 
     def move(self, source_file, old_parents):
         try:
-            source_file.Upload({
+            self.controller.call(source_file.Upload, {
                 "addParents": self.destination,
                 "removeParents": old_parents
             })
         except ApiRequestError as e:
             print("error: cannot move this file %s; %s" % (source_file["id"], str(e)))
         else:
+            self._forget_paths(source_file["id"])
             print("moved %s to %s" % (source_file["id"], self.destination))
 
 
 class RenameHandler(Handler):
     def __init__(self):
         super().__init__("rename")
+        self.fresh = True
 
     def process(self, options):
-        self.id = options.id
+        self._open_cache(options)
+        self.id = self._resolve([options.id])[0]
         self.name = options.name
 
     def execute(self):
         file = self.drive.CreateFile(metadata = {"id": self.id})
-        file.FetchMetadata(fields = "id,title")
+        self.controller.call(file.FetchMetadata, fields = "id,title")
         file["title"], self.old_name = self.name, file["title"]
         threading.Thread(
             target = self.rename,
@@ -475,20 +1215,23 @@ class RenameHandler(Handler):
 
     def rename(self, file):
         try:
-            file.Upload()
+            self.controller.call(file.Upload)
         except ApiRequestError as e:
             print("error: cannot rename this file %s; %s" % (self.old_name, str(e)))
         else:
+            self._forget_paths(file["id"])
             print("renamed '%s' to '%s'" % (self.old_name, file["title"]))
 
 
 class ShareHandler(Handler):
     def __init__(self):
         super().__init__("share")
+        self.fresh = True
         self.status = []
 
     def process(self, options):
-        self.files = [self.drive.CreateFile(metadata = {"id": id}) for id in options.ids]
+        self._open_cache(options)
+        self.files = [self.drive.CreateFile(metadata = {"id": id}) for id in self._resolve(options.ids)]
         self.type = options.type
         self.value = options.user
         if options.writable:
@@ -501,7 +1244,7 @@ class ShareHandler(Handler):
     def execute(self):
         tasks = []
         for file in self.files:
-            file.FetchMetadata(fields = "title,alternateLink,permissions")
+            self.controller.call(file.FetchMetadata, fields = "title,alternateLink,permissions")
             task = threading.Thread(
                 target = self.share,
                 args = (file,)
@@ -515,7 +1258,7 @@ class ShareHandler(Handler):
     def share(self, file):
         status = []
         try:
-            file.InsertPermission({"type": self.type, "role": self.role, "value": self.value}) 
+            self.controller.call(file.InsertPermission, {"type": self.type, "role": self.role, "value": self.value})
         except ApiRequestError as e:
             status.append("error: cannot share this file %s(%s); %s\n" % (file["title"], file["id"], str(e)))
         else:
@@ -530,15 +1273,17 @@ class ShareHandler(Handler):
 class UnShareHandler(Handler):
     def __init__(self):
         super().__init__("unshare")
+        self.fresh = True
         self.status = []
 
     def process(self, options):
-        self.files = [self.drive.CreateFile(metadata = {"id": id}) for id in options.ids]
+        self._open_cache(options)
+        self.files = [self.drive.CreateFile(metadata = {"id": id}) for id in self._resolve(options.ids)]
     
     def execute(self):
         tasks = []
         for file in self.files:
-            file.FetchMetadata(fields = "title,alternateLink,permissions")
+            self.controller.call(file.FetchMetadata, fields = "title,alternateLink,permissions")
             task = threading.Thread(
                 target = self.unshare,
                 args = (file,)
@@ -554,7 +1299,7 @@ class UnShareHandler(Handler):
         try:
             permission_ids = "\n".join(["Permission ID: %-30s\tUser: %s" % (p.get("id"), p.get("emailAddress") or p.get("id")) for p in file["permissions"]])
             permission_id = input("\nunshare whose access to %s (enter the permission id)?\n%s\n>> \n" % (file["title"], permission_ids))
-            file.DeletePermission(permission_id) 
+            self.controller.call(file.DeletePermission, permission_id)
         except ApiRequestError as e:
             status.append("error: cannot unshare this file %s(%s); %s\n" % (file["title"], file["id"], str(e)))
         else:
@@ -564,3 +1309,140 @@ class UnShareHandler(Handler):
                 status.append(">> %s (%s) (role: %s)\n"  % (i.get("name") or i.get("id"), i.get("emailAddress"), i.get("role")))
             status.append("\n")
             self.status.append("".join(status))
+
+
+class ChangesHandler(Handler):
+    def __init__(self):
+        super().__init__("changes")
+        self.formatter = Formatter()
+
+    def process(self, options):
+        self.reset = options.reset
+        self.cache = MetadataCache()
+
+    def execute(self):
+        if self.reset:
+            feed = ChangesFeed(auth = self.drive.auth)
+            self.cache.set_state(self._changes_key(), self.controller.call(feed.get_start_page_token))
+            print("changes to your google drive will be tracked from now on.")
+            return
+        try:
+            for change in self._list_changes(self.formatter.fields()):
+                if is_removed(change):
+                    self.formatter.message("removed %s" % change["fileId"])
+                else:
+                    self.formatter.display(change["file"])
+        except ApiRequestError as e:
+            self.formatter.flush()
+            print("error: cannot fetch the changes of your google drive; %s" % str(e))
+            sys.exit(1)
+        self.formatter.flush()
+
+
+class CatHandler(Handler):
+    def __init__(self):
+        super().__init__("cat")
+        self.export_format = utils.ExportFormat()
+        self.start = 0
+        self.end = None
+
+    def process(self, options):
+        if options.export_format:
+            self.export_format = utils.ExportFormat.from_format_string(options.export_format)
+        elif options.pdf:
+            self.export_format.export_all_to_pdf()
+        if options.range:
+            match = re.fullmatch(r"(\d+)-(\d*)", options.range.strip())
+            if match is None or (match.group(2) and int(match.group(2)) < int(match.group(1))):
+                print("error: invalid --range '%s'; expecting START-END or START-, e.g. 0-1023" % options.range)
+                sys.exit(1)
+            self.start = int(match.group(1))
+            self.end = int(match.group(2)) if match.group(2) else None
+        self._open_cache(options)
+        self.file = self.drive.CreateFile(metadata = {"id": self._resolve([options.id])[0]})
+
+    def execute(self):
+        try:
+            self.controller.call(self.file.FetchMetadata, fields = "id,title,mimeType")
+            mimetype = self.file["mimeType"]
+            if mimetype == FOLDER_MIMETYPE:
+                print("error: '%s' is a folder" % self.file["title"], file = sys.stderr)
+                sys.exit(1)
+            elif mimetype.startswith("application/vnd.google-apps."):
+                url = EXPORT_URL % (self.file["id"], quote(self.export_format[mimetype], safe = ""))
+            else:
+                url = MEDIA_URL % self.file["id"]
+            ContentStream(self.file.auth, url, controller = self.controller).copy(sys.stdout.buffer, self.start, self.end)
+        except KeyError:
+            print("error: '%s' cannot be exported; choose an export format with --export-format" % self.file["title"], file = sys.stderr)
+            sys.exit(1)
+        except BrokenPipeError:
+            # the reader has gone away, e.g. gdrive cat ... | head
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+        except (ApiRequestError, OSError) as e:
+            print("error: cannot read this file %s; %s" % (self.file["id"], str(e)), file = sys.stderr)
+            sys.exit(1)
+
+
+class CacheHandler(Handler):
+    def __init__(self):
+        super().__init__("cache")
+
+    def process(self, options):
+        self.action = options.action
+        self.max_size = int(options.max_size * 1e6) if options.max_size is not None else 0
+        self.blobs = BlobCache()
+
+    def execute(self):
+        if self.action == "stats":
+            count, size = self.blobs.stats()
+            print("%d files, %s of %s in %s" % (count, texts.format_file_size(size), texts.format_file_size(self.blobs.max_size), self.blobs.path))
+        elif self.action == "prune":
+            print("evicted %d files" % self.blobs.prune(self.max_size))
+
+
+class ResumeHandler(Handler):
+    def __init__(self):
+        super().__init__("resume")
+        self.handler = None
+
+    def process(self, options):
+        try:
+            journal = Journal.open(options.id)
+        except JournalError as e:
+            print("error: %s" % str(e))
+            sys.exit(1)
+        self.handler = create_handler(journal.type)
+        self.handler.attach(self.drive)
+        self.handler.resume(journal)
+
+    def execute(self):
+        self.handler.execute()
+
+
+class JobsHandler(Handler):
+    def __init__(self):
+        super().__init__("jobs")
+        self.journals = []
+
+    def process(self, options):
+        try:
+            self.journals = Journal.outstanding()
+        except JournalError as e:
+            print("error: %s" % str(e))
+            sys.exit(1)
+
+    def execute(self):
+        if not self.journals:
+            print("no outstanding jobs")
+        for journal in self.journals:
+            print("%s  %-8s %s  %d/%d items done, %d failed%s" % (
+                journal.id,
+                journal.type,
+                datetime.fromtimestamp(journal.created).strftime("%Y-%m-%d %H:%M"),
+                len(journal.done & journal.planned),
+                len(journal.planned),
+                len(journal.failed),
+                "" if journal.planned_all else ", interrupted while listing"
+            ))
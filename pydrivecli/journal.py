@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+
+from .utils import JOBS
+
+__all__ = ["Journal", "JournalError"]
+
+
+class JournalError(Exception):
+    pass
+
+
+class Journal(object):
+    """Append-only record of the items of a long transfer.
+
+    Every line of the journal is a json record: the header, which holds the
+    command and its options, then one record per item as it is planned,
+    given an id (for the folders of an upload), done or failed, and a record
+    once every item has been planned. Records
+    are flushed as they are written, so the journal of a process which is
+    killed is complete up to its last line, and a torn last line is simply
+    ignored. A job whose items are all done removes its journal. Only the
+    items are kept in memory; the records of the items left are read from
+    the journal again when the job is resumed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.id = path.name
+        self.lock = threading.Lock()
+        self.type = None
+        self.options = {}
+        self.created = None
+        self.planned = set()
+        self.done = set()
+        self.failed = {}
+        # the ids reserved for the folders so far
+        self.folder_ids = {}
+        self.planned_all = False
+        # what the job needs to finish once every item has been planned
+        self.state = {}
+        self.file = None
+
+    @classmethod
+    def create(cls, type, options, directory=JOBS):
+        directory.mkdir(parents = True, exist_ok = True)
+        id = "%s-%s" % (time.strftime("%Y%m%d-%H%M%S"), os.urandom(2).hex())
+        journal = cls(directory / id)
+        journal.type = type
+        journal.options = options
+        journal.created = time.time()
+        journal._append({"event": "start", "type": type, "options": journal.options, "created": journal.created})
+        return journal
+
+    @classmethod
+    def open(cls, id, directory=JOBS):
+        journal = cls(directory / id)
+        if not journal.path.is_file():
+            raise JournalError("no such job: '%s'; see 'gdrive jobs'" % id)
+        journal._load()
+        return journal
+
+    @classmethod
+    def outstanding(cls, directory=JOBS):
+        if not directory.is_dir():
+            return []
+        return [cls.open(path.name, directory) for path in sorted(directory.iterdir()) if path.is_file()]
+
+    def remaining(self):
+        """Yield the records of the items planned but not done yet."""
+        for record in self._records():
+            if record.get("event") == "planned" and record["item"] not in self.done:
+                yield record["record"]
+
+    def plan(self, item, record):
+        with self.lock:
+            if item in self.planned:
+                return
+            self.planned.add(item)
+        self._append({"event": "planned", "item": item, "record": record})
+
+    def mark_reserved(self, item, id):
+        with self.lock:
+            self.folder_ids[item] = id
+        self._append({"event": "reserved", "item": item, "id": id})
+
+    def mark_done(self, item):
+        with self.lock:
+            self.done.add(item)
+            self.failed.pop(item, None)
+        self._append({"event": "done", "item": item})
+
+    def mark_failed(self, item, error):
+        with self.lock:
+            self.failed[item] = str(error)
+        self._append({"event": "failed", "item": item, "error": str(error)})
+
+    def mark_planned_all(self, **state):
+        self.planned_all = True
+        self.state = state
+        self._append({"event": "planned all", "state": state})
+
+    def close(self):
+        # the journal of a job which has nothing left to do is of no use
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if self.planned_all and self.planned <= self.done:
+                self.path.unlink()
+
+    def _append(self, record):
+        line = json.dumps(record, ensure_ascii = False) + "\n"
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a")
+            self.file.write(line)
+            self.file.flush()
+
+    def _records(self):
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # the last line of a journal which was being written
+                    continue
+
+    def _load(self):
+        for record in self._records():
+            event = record.get("event")
+            if event == "start":
+                self.type = record["type"]
+                self.options = record["options"]
+                self.created = record["created"]
+            elif event == "planned":
+                self.planned.add(record["item"])
+            elif event == "reserved":
+                self.folder_ids[record["item"]] = record["id"]
+            elif event == "done":
+                self.done.add(record["item"])
+                self.failed.pop(record["item"], None)
+            elif event == "failed":
+                self.failed[record["item"]] = record["error"]
+            elif event == "planned all":
+                self.planned_all = True
+                self.state = record.get("state", {})
+        if self.type is None:
+            raise JournalError("the journal of the job '%s' is damaged" % self.id)
@@ -0,0 +1,146 @@
+from contextlib import contextmanager
+import sys
+import threading
+import time
+
+from . import texts
+from .transfers import TransferSummary
+
+# seconds between two redraws on a terminal, and between two log lines
+# otherwise, e.g. when running from cron
+REFRESH_INTERVAL = 0.5
+LOG_INTERVAL = 10
+# number of the slowest active transfers shown on a terminal
+SLOWEST = 3
+
+__all__ = ["ProgressDisplay"]
+
+
+class Transfer(object):
+    def __init__(self, title, size):
+        self.title = title
+        self.size = size
+        self.done = 0
+        self.started = time.monotonic()
+
+    def update(self, done, total):
+        # same signature as the progress callbacks of pydrive2
+        self.done = done
+        if total:
+            self.size = total
+
+    def rate(self, now):
+        return self.done / max(now - self.started, 1e-6)
+
+
+class ProgressDisplay(TransferSummary):
+    """One progress display for every transfer of a command.
+
+    Transfers only record their progress, while a single thread draws the
+    overall bytes, the number of files done, the throughput, the estimated
+    time left and the slowest active transfers at a fixed rate. On a
+    terminal the display is redrawn in place; otherwise one line is logged
+    every LOG_INTERVAL seconds.
+    """
+
+    def __init__(self, verb="downloaded", stream=None, slowest=SLOWEST):
+        super().__init__(verb)
+        self.stream = stream or sys.stderr
+        self.slowest = slowest
+        self.tty = self.stream.isatty()
+        self.interval = REFRESH_INTERVAL if self.tty else LOG_INTERVAL
+        self.queued_files = 0
+        self.queued_bytes = 0
+        self.active = set()
+        self.finished_bytes = 0
+        self.draw_lock = threading.Lock()
+        self.lines = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target = self._refresh, daemon = True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+        with self.draw_lock:
+            self._clear()
+
+    def queued(self, size):
+        with self.lock:
+            self.queued_files += 1
+            self.queued_bytes += size or 0
+
+    def begin(self, title, size):
+        transfer = Transfer(title, size)
+        with self.lock:
+            self.active.add(transfer)
+        return transfer
+
+    def end(self, transfer):
+        with self.lock:
+            self.active.discard(transfer)
+            self.finished_bytes += transfer.done
+
+    def message(self, text):
+        with self.draw_lock:
+            self._clear()
+            print(text, file = self.stream)
+
+    @contextmanager
+    def paused(self):
+        # e.g. while asking the user a question
+        with self.draw_lock:
+            self._clear()
+            yield
+
+    def _refresh(self):
+        while not self.stopped.wait(self.interval):
+            with self.draw_lock:
+                self._clear()
+                self._draw()
+
+    def _status(self):
+        now = time.monotonic()
+        with self.lock:
+            active = list(self.active)
+            done = self.finished_bytes + sum(transfer.done for transfer in active)
+            files = self.files + len(self.failures)
+            queued_files, queued_bytes = self.queued_files, self.queued_bytes
+        elapsed = max(now - self.started, 1e-6)
+        rate = done / elapsed
+        status = "%s %d/%d files, %s of %s, %s/s" % (
+            self.verb,
+            files,
+            queued_files,
+            texts.format_bytes(done),
+            texts.format_bytes(queued_bytes),
+            texts.format_bytes(rate)
+        )
+        if rate > 0 and queued_bytes > done:
+            status += ", ETA %s" % texts.format_duration((queued_bytes - done) / rate)
+        return status, sorted(active, key = lambda transfer: transfer.rate(now))[:self.slowest], now
+
+    def _draw(self):
+        status, slowest, now = self._status()
+        if not self.tty:
+            print(time.strftime("%Y-%m-%d %H:%M:%S ") + status, file = self.stream)
+            self.stream.flush()
+            return
+        lines = [status]
+        for transfer in slowest:
+            percent = "%3d%%" % (100 * transfer.done / transfer.size) if transfer.size else "   ?"
+            lines.append("  %-40.40s %s %10s/s" % (transfer.title, percent, texts.format_bytes(transfer.rate(now))))
+        self.stream.write("\n".join(lines) + "\n")
+        self.stream.flush()
+        self.lines = len(lines)
+
+    def _clear(self):
+        # move back to the first line of the display and clear it
+        if self.tty and self.lines:
+            self.stream.write("\033[%dA\033[J" % self.lines)
+            self.stream.flush()
+        self.lines = 0
@@ -1,3 +1,10 @@
+# The number of folders listed by one request when traversing a folder tree,
+# and the longest query sent in one request; a query for more folders is
+# split into several requests.
+FOLDERS_PER_QUERY = 30
+MAX_QUERY_LENGTH = 2000
+
+
 class ValidationError(Exception):
     pass
 
@@ -113,7 +120,7 @@ class FileListParams(RequestParams):
         },
         "fields": {
             "type": str,
-            "default": "items(%s)" %
+            "default": "nextPageToken,items(%s)" %
                 "alternateLink,appDataContents,"
                 "canComment,canReadRevisions,capabilities,"
                 "copyable,createdDate,defaultOpenWithLink,description,"
@@ -137,3 +144,37 @@ class FileListParams(RequestParams):
 
     def __init__(self):
         self.populate()
+
+    def set_fields(self, fields):
+        # request only these properties of each file, and keep the page token
+        # and the etag of the list so that the results can still be paged
+        # through and revalidated
+        fields = ",".join(dict.fromkeys(field.strip() for field in fields if field.strip()))
+        self["fields"] = "nextPageToken,etag,items(%s)" % fields
+
+
+def quote(value):
+    # quote a string value for a query, e.g. title='it\'s'
+    return "'%s'" % value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def or_queries(clauses, max_length=MAX_QUERY_LENGTH):
+    """Yield "a or b or ..." queries joining these clauses, each no longer
+    than max_length."""
+    chunk = []
+    length = 0
+    for clause in clauses:
+        if chunk and length + len(" or ") + len(clause) > max_length:
+            yield " or ".join(chunk)
+            chunk = []
+            length = 0
+        length += len(clause) + (len(" or ") if chunk else 0)
+        chunk.append(clause)
+    if chunk:
+        yield " or ".join(chunk)
+
+
+def parents_queries(ids, max_length=MAX_QUERY_LENGTH):
+    """Yield "'a' in parents or 'b' in parents ..." queries for these ids,
+    each no longer than max_length."""
+    return or_queries(("%s in parents" % quote(id) for id in ids), max_length)
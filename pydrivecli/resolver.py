@@ -0,0 +1,104 @@
+from collections import defaultdict
+
+from . import requests
+
+# the first component of every path, which stands for the root folder
+ROOT_NAME = "MyDrive"
+
+__all__ = ["PathResolver", "ResolveError", "is_path"]
+
+
+class ResolveError(Exception):
+    pass
+
+
+def is_path(value):
+    # ids never contain slashes
+    return value.strip() == ROOT_NAME or "/" in value
+
+
+def split_path(path):
+    components = [component for component in path.strip().split("/") if component]
+    if not components or components[0] != ROOT_NAME:
+        raise ResolveError("'%s' is not a path in your drive; paths start with '%s/'" % (path, ROOT_NAME))
+    return tuple(components)
+
+
+class PathResolver(object):
+    """Resolves paths like 'MyDrive/projects/x/y' to the ids of the files.
+
+    Every path is walked component by component. All paths given to
+    `resolve` are walked together one level at a time, so that a common
+    prefix is looked up once and the titles wanted in the same folder are
+    looked up with one query. Resolved prefixes are kept for the next calls,
+    and in the metadata cache, if any, for the next runs. If `fetch` is
+    given, an id from the metadata cache is only used once the file has been
+    fetched and is still at that path; otherwise the path is looked up again.
+    """
+
+    def __init__(self, list_files, cache=None, fetch=None):
+        # list_files takes list request parameters and yields the files, and
+        # fetch takes an id and returns the file or None if there is none
+        self.list_files = list_files
+        self.cache = cache
+        self.fetch = fetch
+        self.ids = {(ROOT_NAME,): "root"}
+
+    def resolve(self, values):
+        """Return the ids of these values, which are either ids or paths."""
+        paths = [split_path(value) for value in values if is_path(value)]
+        depth = 1
+        while any(len(path) > depth for path in paths):
+            # the titles still to look up in every folder at this depth
+            lookups = defaultdict(set)
+            for path in paths:
+                if len(path) > depth and path[:depth + 1] not in self.ids:
+                    if not self._load(path[:depth + 1]):
+                        lookups[path[:depth]].add(path[depth])
+            for prefix, titles in lookups.items():
+                self._lookup(prefix, titles)
+            depth += 1
+        return [self.ids[split_path(value)] if is_path(value) else value.strip() for value in values]
+
+    def _load(self, prefix):
+        if self.cache is None:
+            return False
+        id = self.cache.get_path("/".join(prefix))
+        if id is None:
+            return False
+        if self.fetch is not None and not self._is_at(id, prefix):
+            self.cache.forget_paths(id)
+            return False
+        self.ids[prefix] = id
+        return True
+
+    def _is_at(self, id, prefix):
+        # the file may have been renamed, moved, trashed or deleted since
+        file = self.fetch(id)
+        if file is None or file["title"] != prefix[-1] or file.get("labels", {}).get("trashed"):
+            return False
+        parent = self.ids[prefix[:-1]]
+        return any(
+            p["id"] == parent or (parent == "root" and p.get("isRoot")) for p in file.get("parents") or []
+        )
+
+    def _lookup(self, prefix, titles):
+        found = defaultdict(list)
+        clauses = ["title=%s" % requests.quote(title) for title in sorted(titles)]
+        for titles_query in requests.or_queries(clauses):
+            param = requests.FileListParams()
+            param["q"] = "%s in parents and trashed=false and (%s)" % (requests.quote(self.ids[prefix]), titles_query)
+            param.set_fields(["id", "title"])
+            for file in self.list_files(param):
+                found[file["title"]].append(file["id"])
+
+        for title in titles:
+            path = "/".join(prefix + (title,))
+            ids = found.get(title, [])
+            if not ids:
+                raise ResolveError("No such file or folder: '%s'" % path)
+            if len(ids) > 1:
+                raise ResolveError("'%s' is ambiguous; it matches the files with ids: %s" % (path, ", ".join(ids)))
+            self.ids[prefix + (title,)] = ids[0]
+            if self.cache is not None:
+                self.cache.set_path(path, ids[0])
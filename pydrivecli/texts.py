@@ -1,4 +1,6 @@
+import re
 from datetime import datetime
+from functools import lru_cache
 
 class EnhancedText(str):
     def __new__(cls, text, prefix="", suffix=""):
@@ -51,27 +53,64 @@ class LinkText(object):
 
 class DatetimeText(object):
     def __new__(cls, text):
-        try:
-            date_time = datetime.strptime(text, "%Y-%m-%dT%H:%M:%S.%fZ")
-        except Exception:
-            return EnhancedText(text)
-        else:
-            if datetime.now().year > date_time.year:
-                return EnhancedText(date_time.strftime("%b %-2d %-4Y"))
-            else:
-                return EnhancedText(date_time.strftime("%b %-2d %H:%M"))
+        return EnhancedText(format_datetime(text))
 
 
 class FileSizeText(object):
     def __new__(cls, text):
-        if text is None:
-            return EnhancedText(text)
-        # display in MB
-        return EnhancedText(round(float(text) / 1e6), suffix = " MB")
+        return EnhancedText(format_file_size(text))
 
 
 class ExecutableText(object):
     def __new__(cls, text):
         text = EnhancedText(text).rgb(59, 191, 59)
         suffix = EnhancedText("*")
-        return text.add_suffix(suffix)
\ No newline at end of file
+        return text.add_suffix(suffix)
+
+
+_SECONDS = re.compile(r":\d\d\.\d{1,6}Z")
+
+
+def format_datetime(text):
+    # only the minutes are displayed, so files modified within the same
+    # minute share the same formatted date
+    try:
+        if not _SECONDS.fullmatch(text, 16):
+            raise ValueError()
+        return _format_minutes(text[:16])
+    except Exception:
+        return str(text)
+
+
+@lru_cache(maxsize = 65536)
+def _format_minutes(text):
+    date_time = datetime.strptime(text, "%Y-%m-%dT%H:%M")
+    if datetime.now().year > date_time.year:
+        return date_time.strftime("%b %-2d %-4Y")
+    else:
+        return date_time.strftime("%b %-2d %H:%M")
+
+
+def format_file_size(text):
+    if text is None:
+        return str(text)
+    # display in MB
+    return "%s MB" % round(float(text) / 1e6)
+
+
+def format_bytes(size):
+    # e.g. 1.2 GB, with one decimal for anything above a byte
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(size) < 1000 or unit == "TB":
+            break
+        size /= 1000
+    return "%d %s" % (size, unit) if unit == "B" else "%.1f %s" % (size, unit)
+
+
+def format_duration(seconds):
+    # e.g. 3:05 or 1:02:03
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%d:%02d:%02d" % (hours, minutes, seconds)
+    return "%d:%02d" % (minutes, seconds)
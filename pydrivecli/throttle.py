@@ -0,0 +1,106 @@
+import random
+import threading
+import time
+
+from pydrive2.files import ApiRequestError
+
+# requests in flight at first, and at most, across every thread
+INITIAL_LIMIT = 8
+MAX_LIMIT = 32
+# attempts of a throttled request before its error is given up to the caller
+MAX_RETRIES = 8
+# the longest wait between two attempts without a Retry-After header
+MAX_BACKOFF = 64
+
+__all__ = ["RateController", "controller", "is_throttled"]
+
+
+def is_throttled(error):
+    # the responses google drive asks to be retried with exponential backoff
+    code = error.error.get("code")
+    if code == 403:
+        return error.GetField("reason") in ("rateLimitExceeded", "userRateLimitExceeded")
+    return code in (429, 500, 502, 503, 504)
+
+
+def retry_after(error):
+    response = getattr(error.args[0], "resp", None) if error.args else None
+    try:
+        return float(response.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class RateController(object):
+    """Limits the number of requests in flight to what the quota allows.
+
+    Every request made through `call` takes one of `limit` slots. A
+    throttled response halves the limit and holds back every request until
+    the wait asked by its Retry-After header, or an exponential backoff, has
+    passed; the throttled request is then retried. Every successful request
+    raises the limit again by 1/limit, so it grows by about one request per
+    round trip of a full window, up to `max_limit`.
+    """
+
+    def __init__(self, limit=INITIAL_LIMIT, max_limit=MAX_LIMIT, retries=MAX_RETRIES):
+        self.limit = float(limit)
+        self.max_limit = max_limit
+        self.retries = retries
+        self.in_flight = 0
+        self.resume_at = 0.0
+        self.decreased_at = 0.0
+        self.condition = threading.Condition()
+
+    def call(self, function, *args, **kwargs):
+        """Return function(*args, **kwargs), retrying it while throttled."""
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                result = function(*args, **kwargs)
+            except ApiRequestError as e:
+                if attempt >= self.retries or not is_throttled(e):
+                    self._release(False)
+                    raise
+                self._backoff(e, attempt)
+                attempt += 1
+            except BaseException:
+                self._release(False)
+                raise
+            else:
+                self._release(True)
+                return result
+
+    def _acquire(self):
+        with self.condition:
+            while True:
+                wait = self.resume_at - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    break
+                self.condition.wait(wait if wait > 0 else None)
+            self.in_flight += 1
+
+    def _release(self, succeeded):
+        with self.condition:
+            self.in_flight -= 1
+            if succeeded:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def _backoff(self, error, attempt):
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(MAX_BACKOFF, 2 ** attempt) + random.random()
+        with self.condition:
+            now = time.monotonic()
+            # the requests throttled together only halve the limit once
+            if now - self.decreased_at > 1:
+                self.limit = max(1.0, self.limit / 2)
+                self.decreased_at = now
+            self.resume_at = max(self.resume_at, now + delay)
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+
+# shared by every handler, so that all requests count against one limit
+controller = RateController()
@@ -0,0 +1,143 @@
+import math
+import queue
+import threading
+import time
+
+from . import texts
+
+# number of transfers waiting for a worker before the producer is blocked
+QUEUE_DEPTH = 1000
+
+__all__ = ["TransferQueue", "TransferSummary", "QUEUE_DEPTH"]
+
+
+class TransferQueue(object):
+    """Runs `transfer` on a pool of `jobs` threads for every item put.
+
+    Items are transferred while they are still being discovered. At most
+    `depth` items wait for a worker and `put` blocks while the queue is
+    full, so memory stays flat however many items there are. Waiting items
+    are taken lowest `priority` first, then in the order they were put.
+    Leaving the `with` block waits for every item to be transferred, or
+    drops the waiting items if the block is left with an exception or
+    interrupted while waiting.
+    """
+
+    def __init__(self, transfer, jobs=1, depth=QUEUE_DEPTH):
+        self.transfer = transfer
+        self.jobs = max(1, jobs)
+        self.queue = queue.PriorityQueue(maxsize = depth)
+        self.stopped = threading.Event()
+        self.count = 0
+        self.error = None
+        self.workers = []
+
+    def __enter__(self):
+        self.workers = [threading.Thread(target = self._work) for _ in range(self.jobs)]
+        for worker in self.workers:
+            worker.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._stop()
+        try:
+            for _ in self.workers:
+                self._put(math.inf, None)
+            for worker in self.workers:
+                worker.join()
+        except BaseException:
+            # interrupted while waiting; the workers finish the item they
+            # hold and return
+            self._stop()
+            raise
+        if self.error is not None and exc_type is None:
+            raise self.error
+
+    def put(self, item, priority=0):
+        if self.error is not None:
+            raise self.error
+        self._put(priority, item)
+
+    def _stop(self):
+        self.stopped.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        for _ in self.workers:
+            self._put(math.inf, None)
+
+    def _put(self, priority, item):
+        self.count += 1
+        self.queue.put((priority, self.count, item))
+
+    def _work(self):
+        while True:
+            _, _, item = self.queue.get()
+            if item is None:
+                return
+            if self.stopped.is_set():
+                continue
+            try:
+                self.transfer(item)
+            except BaseException as e:
+                self.error = e
+                self.stopped.set()
+
+
+class TransferSummary(object):
+    """Counts the files and bytes moved by a pool of transfers.
+
+    Every transfer reports its result with `done` or `failed` from its own
+    thread; `report` describes the whole run once the pool has finished.
+    """
+
+    def __init__(self, verb="downloaded"):
+        self.verb = verb
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.files = 0
+        self.cached = 0
+        self.duplicates = 0
+        self.bytes = 0
+        self.saved = 0
+        self.failures = []
+
+    def done(self, size, cached=False):
+        with self.lock:
+            self.files += 1
+            self.cached += cached
+            self.bytes += size
+
+    def linked(self, size):
+        # a copy of content which has been transferred already
+        with self.lock:
+            self.files += 1
+            self.duplicates += 1
+            self.saved += size
+
+    def failed(self, title, error):
+        with self.lock:
+            self.failures.append((title, str(error)))
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        notes = []
+        if self.cached:
+            notes.append("%d from the cache" % self.cached)
+        if self.duplicates:
+            notes.append("%d linked to duplicates, %s saved" % (self.duplicates, texts.format_bytes(self.saved)))
+        lines = ["%s %d files%s, %s in %.1fs (%s/s), %d failed" % (
+            self.verb,
+            self.files,
+            " (%s)" % "; ".join(notes) if notes else "",
+            texts.format_bytes(self.bytes),
+            elapsed,
+            texts.format_bytes(self.bytes / elapsed),
+            len(self.failures)
+        )]
+        for title, error in self.failures:
+            lines.append("error: '%s' failed; %s" % (title, error))
+        return "\n".join(lines)
@@ -0,0 +1,75 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+FOLDER_MIMETYPE = "application/vnd.google-apps.folder"
+
+__all__ = ["FolderWalker", "FOLDER_MIMETYPE"]
+
+
+class FolderWalker(object):
+    """Breadth-first walker which lists many folders concurrently.
+
+    Folders are grouped into batches of up to `batch_size` folders, and every
+    batch is listed by one call of `list_children` on a pool of `jobs`
+    workers. A batch is sent once it is full, or once the walk has to wait
+    for it. The results are consumed in the order the folders were pushed,
+    so the walk yields exactly the same sequence as a sequential
+    breadth-first traversal with a FIFO queue.
+    """
+
+    def __init__(self, list_children, jobs=1, batch_size=1):
+        # list_children takes a list of folder metadata and returns a dict
+        # which maps the id of every folder to its children
+        self.list_children = list_children
+        self.jobs = max(1, jobs)
+        self.batch_size = max(1, batch_size)
+        self.executor = None
+        self.pending = deque()
+        self.batch = None
+        self.futures = []
+
+    def push(self, key, folder):
+        """Schedule `folder` to be listed; `key` is yielded along with it."""
+        if self.batch is None:
+            self.batch = {"folders": [], "future": None}
+        self.batch["folders"].append(folder)
+        self.pending.append((key, folder, self.batch))
+        if len(self.batch["folders"]) >= self.batch_size:
+            self._submit()
+
+    def walk(self, roots):
+        """Yield (key, folder, children) for every folder pushed.
+
+        `roots` is an iterable of (key, folder) pairs to start with; the
+        caller pushes the subfolders it wants to descend into while handling
+        the children of a folder. The first exception raised by
+        `list_children` stops the walk: pending folders are cancelled and the
+        exception is re-raised to the caller.
+        """
+        self.executor = ThreadPoolExecutor(max_workers = self.jobs)
+        try:
+            for key, folder in roots:
+                self.push(key, folder)
+
+            while self.pending:
+                key, folder, batch = self.pending.popleft()
+                if batch["future"] is None:
+                    # nothing else to wait for, send the batch even if it is
+                    # not full yet
+                    self._submit()
+                children = batch["future"].result()[folder["id"]]
+                yield key, folder, children
+        finally:
+            for future in self.futures:
+                future.cancel()
+            self.executor.shutdown(wait = True)
+            self.pending.clear()
+            self.batch = None
+            self.futures = []
+
+    def _submit(self):
+        batch, self.batch = self.batch, None
+        batch["future"] = self.executor.submit(self.list_children, batch["folders"])
+        # only the futures which are still running need to be cancelled
+        self.futures = [future for future in self.futures if not future.done()]
+        self.futures.append(batch["future"])
@@ -0,0 +1,242 @@
+from http.client import HTTPException
+import hashlib
+import json
+import mimetypes
+import os
+from pathlib import Path
+import re
+
+from googleapiclient import errors
+from httplib2 import HttpLib2Error
+from pydrive2.apiattr import ApiAttributeMixin
+from pydrive2.auth import LoadAuth
+from pydrive2.files import ApiRequestError
+
+from .downloads import api_error
+from .traversal import FOLDER_MIMETYPE
+from .utils import UPLOADS
+
+UPLOAD_URL = "https://www.googleapis.com/upload/drive/v2/files?uploadType=resumable&supportsAllDrives=true"
+UPDATE_URL = "https://www.googleapis.com/upload/drive/v2/files/%s?uploadType=resumable&supportsAllDrives=true"
+# every chunk but the last must be a multiple of 256 KiB
+CHUNK_GRANULARITY = 256 * 1024
+# bytes sent by one request; the confirmed offset is saved after each
+CHUNK_SIZE = 8 * 1024 * 1024
+# the most ids generateIds returns at once
+MAX_GENERATED_IDS = 1000
+
+__all__ = ["FolderInsert", "IdGenerator", "ResumableUpload", "SessionExpiredError", "chunk_size", "UPDATE_URL", "UPLOAD_URL"]
+
+_RANGE = re.compile(r"bytes=0-(\d+)")
+
+
+class SessionExpiredError(ConnectionError):
+    pass
+
+
+def chunk_size(megabytes):
+    """Return the chunk size closest to this many MB that the upload
+    endpoint accepts."""
+    return max(1, round(megabytes * 1024 * 1024 / CHUNK_GRANULARITY)) * CHUNK_GRANULARITY
+
+
+class ResumableUpload(ApiAttributeMixin):
+    """Uploads `path` as a new file with `metadata` in a resumable session,
+    or as the new content of the file with this `id`.
+
+    The content is sent in chunks of `chunk_size` bytes to a session opened
+    at `url`. The session uri and the number of bytes the server confirmed
+    are saved in `sessions` after every chunk, keyed by the path, size and
+    mtime of the file and its metadata. A later upload of the same file
+    asks the server where the session stands and continues from there; it
+    starts a new session once the old one has expired.
+    """
+
+    def __init__(self, auth, path, metadata, chunk_size=CHUNK_SIZE, controller=None, sessions=UPLOADS, url=None, id=None):
+        ApiAttributeMixin.__init__(self)
+        self.auth = auth
+        self.path = Path(path).absolute()
+        self.metadata = dict(metadata)
+        if "mimeType" not in self.metadata:
+            self.metadata["mimeType"] = mimetypes.guess_type(str(self.path))[0] or "application/octet-stream"
+        self.chunk_size = chunk_size
+        # every request goes through the rate controller, if any
+        self.controller = controller
+        # an existing file keeps its id and is updated in place
+        self.url = url or (UPDATE_URL % id if id is not None else UPLOAD_URL)
+        self.method = "PUT" if id is not None else "POST"
+        if "modifiedDate" in self.metadata:
+            self.url += "&setModifiedDate=true"
+        stat = self.path.stat()
+        self.size = stat.st_size
+        key = json.dumps([str(self.path), self.size, stat.st_mtime_ns, self.metadata, self.url], sort_keys = True)
+        self.state = Path(sessions) / ("%s.json" % hashlib.sha256(key.encode()).hexdigest())
+        self.uri = None
+        self.offset = 0
+        # whether the offset is the one the server has confirmed last
+        self.confirmed = False
+        self.result = None
+
+    @LoadAuth
+    def run(self, callback=None):
+        """Upload the file; return the metadata of the file created."""
+        self.uri = self._load()
+        if self.uri is None:
+            self._start()
+        try:
+            self._send(callback)
+        except SessionExpiredError:
+            # a session is kept for about a week by the server
+            self._start()
+            self._send(callback)
+        if self.state.exists():
+            self.state.unlink()
+        return self.result
+
+    def _start(self):
+        self.uri = self._call(self._request_session)
+        self.offset = 0
+        self.confirmed = True
+        self._save()
+
+    def _send(self, callback):
+        with open(self.path, "rb") as fd:
+            while self.result is None:
+                self._call(self._request_chunk, fd)
+                if callback:
+                    callback(self.offset, self.size)
+
+    def _call(self, function, *args):
+        if self.controller is not None:
+            return self.controller.call(function, *args)
+        return function(*args)
+
+    def _request_session(self):
+        response, content = self._request(self.url, self.method, json.dumps(self.metadata), {
+            "Content-Type": "application/json; charset=UTF-8",
+            "X-Upload-Content-Type": self.metadata["mimeType"],
+            "X-Upload-Content-Length": str(self.size)
+        })
+        if response.status >= 300 or "location" not in response:
+            raise api_error(response, content, self.url)
+        return response["location"]
+
+    def _request_chunk(self, fd):
+        # after a failed request the server may have kept any part of the
+        # chunk, so it is asked where to continue from first
+        if not self.confirmed:
+            self._handle(*self._request(self.uri, "PUT", b"", {"Content-Range": "bytes */%d" % self.size}))
+            if self.result is not None:
+                return
+        fd.seek(self.offset)
+        content = fd.read(self.chunk_size)
+        if content:
+            content_range = "bytes %d-%d/%d" % (self.offset, self.offset + len(content) - 1, self.size)
+        else:
+            content_range = "bytes */%d" % self.size
+        self.confirmed = False
+        self._handle(*self._request(self.uri, "PUT", content, {"Content-Range": content_range}))
+
+    def _request(self, uri, method, body, headers):
+        try:
+            return self.http.request(uri, method = method, body = body, headers = headers)
+        except (HTTPException, HttpLib2Error) as e:
+            raise ConnectionError("connection lost at byte %d; %s" % (self.offset, str(e)))
+
+    def _handle(self, response, content):
+        if response.status in (200, 201):
+            self.offset = self.size
+            self.result = json.loads(content.decode("utf-8"))
+        elif response.status == 308:
+            # the bytes the server has stored, which may be fewer than sent
+            match = _RANGE.match(response.get("range", ""))
+            self.offset = int(match.group(1)) + 1 if match else 0
+            self.confirmed = True
+            self._save()
+        elif response.status in (404, 410):
+            raise SessionExpiredError()
+        else:
+            raise api_error(response, content, self.uri)
+
+    def _load(self):
+        # the session of a previous upload of the same file, if any
+        try:
+            with open(self.state, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.offset = state["offset"]
+        return state["uri"]
+
+    def _save(self):
+        self.state.parent.mkdir(parents = True, exist_ok = True)
+        temporary = Path("%s.tmp" % self.state)
+        with open(temporary, "w") as f:
+            json.dump({"uri": self.uri, "offset": self.offset, "path": str(self.path)}, f)
+        os.replace(temporary, self.state)
+
+
+class IdGenerator(ApiAttributeMixin):
+    """Reserves the ids of files before they are created.
+
+    Equivalent to Files.generateIds() in Drive APIs. A file inserted with a
+    reserved id can be retried without the risk of creating it twice, and
+    its children can be planned before it exists.
+    """
+
+    def __init__(self, auth=None, controller=None):
+        ApiAttributeMixin.__init__(self)
+        self.auth = auth
+        self.controller = controller
+
+    def generate(self, count):
+        ids = []
+        while len(ids) < count:
+            size = min(MAX_GENERATED_IDS, count - len(ids))
+            if self.controller is not None:
+                ids.extend(self.controller.call(self._generate, size))
+            else:
+                ids.extend(self._generate(size))
+        return ids
+
+    @LoadAuth
+    def _generate(self, count):
+        try:
+            response = (
+                self.auth.service.files()
+                .generateIds(maxResults = count, space = "drive")
+                .execute(http = self.http)
+            )
+        except errors.HttpError as error:
+            raise ApiRequestError(error)
+        return response["ids"]
+
+
+class FolderInsert(ApiAttributeMixin):
+    """Creates a folder with the id reserved for it.
+
+    Equivalent to Files.insert() in Drive APIs with the id in the body;
+    GoogleDriveFile.Upload() patches any file which has an id instead.
+    """
+
+    def __init__(self, auth=None, controller=None):
+        ApiAttributeMixin.__init__(self)
+        self.auth = auth
+        self.controller = controller
+
+    def run(self, id, title, parent):
+        if self.controller is not None:
+            return self.controller.call(self._insert, id, title, parent)
+        return self._insert(id, title, parent)
+
+    @LoadAuth
+    def _insert(self, id, title, parent):
+        body = {"id": id, "title": title, "parents": [{"id": parent}], "mimeType": FOLDER_MIMETYPE}
+        try:
+            return (
+                self.auth.service.files()
+                .insert(body = body, supportsAllDrives = True)
+                .execute(http = self.http)
+            )
+        except errors.HttpError as error:
+            raise ApiRequestError(error)
@@ -12,6 +12,11 @@ from pydrive2.settings import InvalidConfigError
 HOME = Path.home()
 BASE = Path.home() / ".gdrive"
 CONFIG = BASE / "config.yaml"
+METADATA_CACHE = BASE / "metadata.sqlite3"
+DIGEST_CACHE = BASE / "digests.sqlite3"
+BLOB_CACHE = BASE / "cache"
+JOBS = BASE / "jobs"
+UPLOADS = BASE / "uploads"
 
 ROOT = HOME / "Google_Drive"
 DOWNLOADS = "Downloads"
@@ -32,7 +32,6 @@ if __name__ == "__main__":
         ],
         packages = ["pydrivecli"],
         install_requires = [
-            "tqdm",
             "pyyaml",
             "pydrive2"
         ]